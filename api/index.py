@@ -12,9 +12,9 @@ import ssl
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Импортируем модули бота
-from db import Database
+from db import create_database
 from twitter_client import TwitterClient
-from utils import create_embed, create_tweet_embed, check_permissions, logger
+from utils import create_embed, create_tweet_embed, check_permissions, logger, TWITTER_ICON_URL
 
 # Отключаем проверку SSL-сертификатов
 ssl._create_default_https_context = ssl._create_unverified_context
@@ -37,7 +37,7 @@ intents.message_content = True
 bot = discord.ext.commands.Bot(command_prefix="!", intents=intents)
 
 # Инициализация базы данных и клиента Twitter
-db = Database()
+db = create_database()
 twitter = TwitterClient()
 
 # Глобальная переменная для хранения бота
@@ -130,9 +130,10 @@ async def track_account(ctx, username: str = None):
         if not user:
             await ctx.send(f"Аккаунт Twitter @{username} не найден.")
             return
+        username = user.username
         
         # Add to tracked accounts
-        result = db.add_tracked_account(username, ctx.guild.id, ctx.channel.id)
+        result = db.add_tracked_account(username, ctx.guild.id, ctx.channel.id, user.id)
         
         if result and "error" in result:
             await ctx.send(result["error"])
@@ -143,13 +144,17 @@ async def track_account(ctx, username: str = None):
             title="Аккаунт Twitter добавлен для отслеживания",
             description=f"Теперь отслеживаются твиты от @{username} в этом канале.",
             color=discord.Color.green(),
-            thumbnail="https://abs.twimg.com/icons/apple-touch-icon-192x192.png"
+            thumbnail=TWITTER_ICON_URL
         )
         
         await ctx.send(embed=embed)
         
         # Get and send the most recent tweet as a preview
-        tweets = twitter.get_recent_tweets(username, max_results=1)
+        try:
+            tweets = twitter.get_recent_tweets(username, max_results=1)
+        except Exception as e:
+            logger.warning(f"Could not fetch a preview tweet for {username}: {e}")
+            return
         if tweets:
             tweet = tweets[0]
             try:
@@ -192,7 +197,7 @@ async def untrack_account(ctx, username: str = None):
             title="Отслеживание аккаунта Twitter прекращено",
             description=f"Больше не отслеживаются твиты от @{username} на этом сервере.",
             color=discord.Color.red(),
-            thumbnail="https://abs.twimg.com/icons/apple-touch-icon-192x192.png"
+            thumbnail=TWITTER_ICON_URL
         )
         
         await ctx.send(embed=embed)
@@ -227,7 +232,7 @@ async def list_tracked_accounts(ctx):
             title="Отслеживаемые аккаунты Twitter",
             description=f"Аккаунты Twitter, отслеживаемые на сервере {ctx.guild.name}",
             color=discord.Color.blue(),
-            thumbnail="https://abs.twimg.com/icons/apple-touch-icon-192x192.png"
+            thumbnail=TWITTER_ICON_URL
         )
         
         # Add fields for each channel
@@ -259,7 +264,7 @@ async def help_command(ctx):
             title="TweetSync Bot - Справка",
             description="Команды для управления отслеживанием аккаунтов Twitter",
             color=discord.Color.blue(),
-            thumbnail="https://abs.twimg.com/icons/apple-touch-icon-192x192.png",
+            thumbnail=TWITTER_ICON_URL,
             fields=[
                 {
                     "name": "!track <username>",
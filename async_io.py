@@ -0,0 +1,105 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from utils import logger
+
+# Load environment variables
+load_dotenv()
+
+# Number of threads used for blocking Supabase and Twitter API calls
+io_pool_size = int(os.getenv("IO_THREAD_POOL_SIZE", "16"))
+
+# How often the event loop lag is sampled and reported, in seconds
+loop_lag_interval = float(os.getenv("LOOP_LAG_INTERVAL", "1"))
+loop_lag_report_interval = float(os.getenv("LOOP_LAG_REPORT_INTERVAL", "300"))
+
+io_executor = ThreadPoolExecutor(max_workers=io_pool_size, thread_name_prefix="tweetsync-io")
+
+class AsyncProxy:
+    """
+    Wraps a blocking client (Database, TwitterClient) so that each method call
+    runs in a bounded thread pool and returns an awaitable instead of blocking
+    the Discord event loop
+    """
+    
+    def __init__(self, target, executor=io_executor):
+        self._target = target
+        self._executor = executor
+    
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+        
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(attr, *args, **kwargs))
+        
+        return call
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up from a fixed sleep.
+    Lag above a few milliseconds means something is blocking the loop.
+    """
+    
+    def __init__(self, interval=loop_lag_interval, report_interval=loop_lag_report_interval):
+        self.interval = interval
+        self.report_interval = report_interval
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._total_lag = 0.0
+        self._samples = 0
+        self._task = None
+    
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+    
+    def start(self):
+        """Start sampling in the running event loop"""
+        if not self.running:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    def stats(self):
+        """
+        Get lag statistics for the current reporting window
+        
+        Returns:
+            dict: Last, average and maximum lag in milliseconds
+        """
+        avg_lag = self._total_lag / self._samples if self._samples else 0.0
+        return {
+            "last_ms": self.last_lag * 1000,
+            "avg_ms": avg_lag * 1000,
+            "max_ms": self.max_lag * 1000
+        }
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_report = loop.time() + self.report_interval
+        
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            
+            self.last_lag = max(0.0, now - started - self.interval)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            self._total_lag += self.last_lag
+            self._samples += 1
+            
+            if now >= next_report:
+                stats = self.stats()
+                logger.info(
+                    f"Event loop lag: avg {stats['avg_ms']:.1f} ms, max {stats['max_ms']:.1f} ms "
+                    f"over {self._samples} samples"
+                )
+                self.max_lag = 0.0
+                self._total_lag = 0.0
+                self._samples = 0
+                next_report = now + self.report_interval
@@ -7,10 +7,17 @@ from dotenv import load_dotenv
 import ssl
 import traceback
 import sys
+import time
 
-from db import Database
-from twitter_client import TwitterClient
-from utils import create_embed, create_tweet_embed, check_permissions, logger
+from db import create_database
+from twitter_client import TwitterClient, pack_usernames, request_timeout
+from rate_limit import RateLimitDeferred
+from scheduler import PollScheduler
+from registry import SubscriptionRegistry
+from stream import StreamIngestion
+from delivery import DeliveryQueue
+from async_io import AsyncProxy, LoopLagMonitor
+from utils import create_embed, create_tweet_embed, check_permissions, logger, TWITTER_ICON_URL
 
 # Настройка более подробного логирования, если включен Debug режим
 if os.environ.get("DISCORD_DEBUG", "0") == "1":
@@ -31,6 +38,23 @@ else:
     token_prefix = TOKEN[:7] + "..." if len(TOKEN) > 10 else "Invalid token"
     logger.info(f"Discord токен загружен: {token_prefix}")
 
+# Polling configuration
+POLL_CONCURRENCY = int(os.getenv("POLL_CONCURRENCY", "8"))  # Accounts fetched in parallel
+POLL_TIMEOUT = float(os.getenv("POLL_TIMEOUT", "30"))  # Seconds allowed per account fetch
+POLL_TICK_INTERVAL = float(os.getenv("POLL_TICK_INTERVAL", "15"))  # How often due accounts are checked
+SUBSCRIPTION_REFRESH_INTERVAL = float(os.getenv("SUBSCRIPTION_REFRESH_INTERVAL", "300"))  # Seconds between incremental tracked_accounts refreshes
+SUBSCRIPTION_FULL_REFRESH_INTERVAL = float(os.getenv("SUBSCRIPTION_FULL_REFRESH_INTERVAL", "3600"))  # Full reloads catch rows deleted by other processes
+# "timeline": one request per account; "search": accounts with a watermark are
+# packed into "from:a OR from:b" search queries
+INGESTION_MODE = os.getenv("INGESTION_MODE", "timeline").lower()
+# Receive tweets from the filtered stream; polling then only runs as a safety net
+STREAM_ENABLED = os.getenv("TWITTER_STREAM_ENABLED", "0") == "1"
+STREAM_SAFETY_POLL_INTERVAL = float(os.getenv("STREAM_SAFETY_POLL_INTERVAL", "3600"))  # Poll interval while the stream is healthy
+# Post tweets through a channel webhook created on !track (needs the Manage Webhooks permission)
+DELIVERY_WEBHOOKS = os.getenv("DELIVERY_WEBHOOKS", "1") == "1"
+WEBHOOK_NAME = "TweetSync"
+CACHE_PRUNE_INTERVAL = float(os.getenv("CACHED_TWEETS_PRUNE_INTERVAL", "3600"))  # Seconds between cached_tweets retention runs
+
 # Bot configuration
 intents = discord.Intents.default()
 intents.message_content = True  # Убедитесь, что этот интент включен в Discord Developer Portal!
@@ -43,9 +67,28 @@ intents.presences = False  # Если этот интент вам нужен, 
 logger.info(f"Настроены интенты: message_content={intents.message_content}, members={intents.members}, presences={intents.presences}")
 bot = commands.Bot(command_prefix="!", intents=intents)
 
-# Initialize database and Twitter client
-db = Database()
-twitter = TwitterClient()
+# Initialize database and Twitter client. Their blocking calls run in a
+# thread pool, so every method returns an awaitable.
+storage = create_database()
+db = AsyncProxy(storage)
+twitter = AsyncProxy(TwitterClient())
+
+# Event loop lag metric
+loop_lag = LoopLagMonitor()
+
+# Adaptive per-account poll schedule and the subscriptions it serves
+scheduler = PollScheduler()
+registry = SubscriptionRegistry()
+since_ids = {}  # Twitter username -> newest processed tweet ID
+since_ids_checked_at = {}  # Twitter username -> start of the last poll that confirmed its since_id
+subscriptions_refreshed_at = None
+subscriptions_loaded_at = None
+stream_was_healthy = False
+tweets_in_delivery = set()  # IDs of tweets being checked against the cache right now
+
+# Outgoing messages, queued per channel and sent by a pool of workers;
+# the outbox keeps them across restarts until they are sent
+delivery = DeliveryQueue(bot, db)
 
 # Полностью отключаем проверку SSL-сертификатов
 ssl._create_default_https_context = ssl._create_unverified_context
@@ -58,9 +101,14 @@ async def on_ready():
     logger.info(f"Guilds: {[guild.name for guild in bot.guilds]}")
     
     # Start background tasks
+    loop_lag.start()
+    delivery.start()
+    if stream:
+        stream.start()
     try:
         check_new_tweets.start()
         logger.info("Background task check_new_tweets started successfully")
+        prune_cached_tweets.start()
     except Exception as e:
         logger.error(f"Error starting background task: {e}")
         logger.error(traceback.format_exc())
@@ -92,66 +140,401 @@ async def ping(ctx):
     except Exception as e:
         logger.error(f"Error executing ping command: {e}")
 
-@tasks.loop(minutes=5)
+@bot.command(name="stats")
+async def stats_command(ctx):
+    """Show bot performance metrics"""
+    try:
+        lag = loop_lag.stats()
+        embed = create_embed(
+            title="TweetSync Bot - Статистика",
+            description="Показатели производительности бота",
+            color=discord.Color.blue(),
+            fields=[
+                {
+                    "name": "Задержка event loop",
+                    "value": f"сейчас {lag['last_ms']:.1f} мс, в среднем {lag['avg_ms']:.1f} мс, максимум {lag['max_ms']:.1f} мс",
+                    "inline": False
+                },
+                {
+                    "name": "Задержка Discord",
+                    "value": f"{bot.latency * 1000:.0f} мс",
+                    "inline": False
+                }
+            ]
+        )
+        
+        embed.add_field(
+            name="Индекс обработанных твитов",
+            value=f"{len(db.seen_tweets)} из {db.seen_tweets.capacity} ID в памяти",
+            inline=False
+        )
+        queued = delivery.stats()
+        embed.add_field(
+            name="Очередь отправки",
+            value=(
+                f"{queued['pending']} твитов в {queued['channels']} каналах (до {queued['max_depth']} в одном), "
+                f"{queued['retrying']} ждут повтора, "
+                f"отправлено {queued['sent']} (через вебхуки {queued['sent_by_webhook']}) "
+                f"в {queued['messages']} сообщениях, ошибок {queued['failed']}"
+            ),
+            inline=False
+        )
+        embed.add_field(
+            name="Отслеживаемые аккаунты",
+            value=f"{len(scheduler)} аккаунтов в расписании опроса",
+            inline=False
+        )
+        
+        # Remaining Twitter API budget per endpoint
+        for endpoint, budget in twitter.rate_limiter.stats().items():
+            embed.add_field(
+                name=f"Twitter {endpoint}",
+                value=f"{budget['remaining']}/{budget['limit']} запросов, сброс через {budget['reset_in'] / 60:.0f} мин",
+                inline=False
+            )
+        await ctx.send(embed=embed)
+    except Exception as e:
+        logger.error(f"Error in stats command: {e}")
+        await ctx.send(f"Произошла ошибка при выполнении команды: {str(e)[:1000]}")
+
+async def refresh_subscriptions():
+    """
+    Bring the subscription registry up to date: a full reload now and then,
+    otherwise only the rows changed since the last refresh
+    """
+    global subscriptions_refreshed_at, subscriptions_loaded_at
+    now = time.time()
+    
+    if registry.cursor is None or now - subscriptions_loaded_at >= SUBSCRIPTION_FULL_REFRESH_INTERVAL:
+        # On a database error keep the registry, the scheduler and the stream
+        # rules as they are rather than dropping every subscription
+        rows = await db.get_tracked_accounts()
+        if rows is None:
+            return
+        registry.load(rows)
+        subscriptions_loaded_at = now
+    else:
+        changed = await db.get_tracked_accounts_updated_since(registry.cursor)
+        if changed is None:
+            return
+        registry.apply_changes(changed)
+    
+    subscriptions_refreshed_at = now
+    await sync_subscriptions()
+
+async def sync_subscriptions():
+    """Bring the poll scheduler and stream rules in line with the registry"""
+    # Every account is fetched only once, no matter how many guilds follow it
+    guilds = registry.guilds_by_username()
+    
+    # Rows of the same account share one watermark, take the newest
+    for username in guilds:
+        since_id = registry.since_id(username)
+        if since_id and int(since_id) > int(since_ids.get(username) or 0):
+            since_ids[username] = since_id
+    
+    scheduler.sync(guilds)
+    await twitter.remember_user_ids(registry.user_ids())
+    
+    if stream:
+        await stream.update_rules(guilds)
+
+def poll_deadline():
+    """
+    Latest time a fetch may send a request and still finish within POLL_TIMEOUT.
+    Rate limit pacing that would wait longer defers the fetch instead, so an
+    abandoned fetch does not spend the budget in the background.
+    """
+    return time.time() + POLL_TIMEOUT - request_timeout
+
+async def fetch_new_tweets(username, semaphore):
+    """
+    Fetch new tweets of one account, limited by the poll concurrency semaphore.
+    If the fetch fails, the account is rescheduled and None is returned.
+    
+    Args:
+        username (str): Twitter username
+        semaphore (asyncio.Semaphore): Limits the number of parallel fetches
+    
+    Returns:
+        list: New tweets in posting order, or None if the fetch failed
+    """
+    async with semaphore:
+        try:
+            # Get tweets newer than the account's watermark, or the latest
+            # few tweets if the account has never been polled
+            tweets = await asyncio.wait_for(
+                twitter.get_recent_tweets(username, max_results=5, since_id=since_ids.get(username), deadline=poll_deadline()),
+                timeout=POLL_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Timed out fetching tweets for {username}")
+            scheduler.postpone(username, scheduler.interval(username) or 0)
+            return None
+        except RateLimitDeferred as e:
+            # The watermark stays where it is, so nothing is lost by retrying later
+            logger.info(f"Deferred fetching tweets for {username}: {e}")
+            scheduler.postpone(username, e.retry_after)
+            return None
+        except Exception as e:
+            logger.error(f"Error fetching tweets for {username}: {e}")
+            scheduler.postpone(username, scheduler.interval(username) or 0)
+            return None
+    
+    return sorted(tweets, key=lambda tweet: int(tweet.id))
+
+async def fetch_new_tweets_by_search(usernames, semaphore):
+    """
+    Fetch new tweets of several accounts with one packed search query,
+    limited by the poll concurrency semaphore. If the fetch fails, all
+    accounts are rescheduled.
+    
+    Args:
+        usernames (list): Twitter usernames that fit in one query, all with a watermark
+        semaphore (asyncio.Semaphore): Limits the number of parallel fetches
+    
+    Returns:
+        dict: Twitter username -> new tweets in posting order, or None if the fetch failed
+    """
+    async with semaphore:
+        try:
+            tweets_by_username = await asyncio.wait_for(
+                twitter.search_recent_tweets_from(
+                    {username: since_ids[username] for username in usernames},
+                    deadline=poll_deadline()
+                ),
+                timeout=POLL_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Timed out searching tweets for {len(usernames)} accounts")
+            tweets_by_username = None
+            delay = None
+        except RateLimitDeferred as e:
+            logger.info(f"Deferred searching tweets for {len(usernames)} accounts: {e}")
+            tweets_by_username = None
+            delay = e.retry_after
+        except Exception as e:
+            logger.error(f"Error searching tweets for {len(usernames)} accounts: {e}")
+            tweets_by_username = None
+            delay = None
+    
+    if tweets_by_username is None:
+        for username in usernames:
+            scheduler.postpone(username, delay if delay is not None else scheduler.interval(username) or 0)
+        return {username: None for username in usernames}
+    
+    return {
+        username: sorted(tweets_by_username.get(username, []), key=lambda tweet: int(tweet.id))
+        for username in usernames
+    }
+
+async def deliver_tweets(tweets_by_username):
+    """
+    Queue new tweets for every channel subscribed to their account, skipping
+    tweets that were already delivered. All tweets are checked against the
+    cache with one batched lookup, recorded in the outbox with one bulk insert
+    and only then cached, so that a tweet is never marked processed before
+    its deliveries are stored.
+    
+    Args:
+        tweets_by_username (dict): Twitter username -> tweets in posting order
+    
+    Returns:
+        bool: False if the deliveries could not be recorded; nothing was sent
+        or cached then, and the watermarks must stay so that the tweets are fetched again
+    """
+    # The stream and the poller can see the same tweet at the same time
+    candidates = {}
+    for username, tweets in tweets_by_username.items():
+        candidates[username] = []
+        for tweet in tweets:
+            if tweet.id in tweets_in_delivery:
+                continue
+            tweets_in_delivery.add(tweet.id)
+            candidates[username].append(tweet)
+    
+    claimed = [tweet.id for tweets in candidates.values() for tweet in tweets]
+    if not claimed:
+        return True
+    
+    try:
+        # Skip tweets that are already cached
+        cached = await db.get_cached_tweet_ids(claimed)
+        new_tweets = {
+            username: [tweet for tweet in tweets if str(tweet.id) not in cached]
+            for username, tweets in candidates.items()
+        }
+        
+        # One delivery per tweet and subscribed channel, rendered once per tweet
+        embeds = {}
+        deliveries = []
+        for username, tweets in new_tweets.items():
+            channel_ids = registry.channels_for(username)
+            for tweet in tweets:
+                embed = embeds[str(tweet.id)] = create_tweet_embed(tweet, username)
+                payload = embed.to_dict()
+                deliveries.extend(
+                    {"tweet_id": str(tweet.id), "twitter_username": username, "channel_id": channel_id, "payload": payload}
+                    for channel_id in channel_ids
+                )
+        
+        # Record the deliveries in the outbox, so that a Discord error or a
+        # restart before they are sent does not lose them
+        outbox_ids = {}
+        if deliveries:
+            recorded = await db.add_outbox(deliveries)
+            if recorded is None:
+                logger.error(f"Could not record {len(deliveries)} deliveries in the outbox, they are retried with the next poll")
+                return False
+            outbox_ids = {(row["tweet_id"], row["channel_id"]): row["id"] for row in recorded}
+        
+        # Cache the new tweets
+        rows = [(tweet.id, username) for username, tweets in new_tweets.items() for tweet in tweets]
+        if rows:
+            await db.cache_tweets(rows)
+    finally:
+        tweets_in_delivery.difference_update(claimed)
+    
+    # Queue the tweets per channel; the delivery workers send them in parallel across channels
+    for item in deliveries:
+        outbox_id = outbox_ids[(item["tweet_id"], str(item["channel_id"]))]
+        # Recorded before and still queued, e.g. replayed after a restart
+        if delivery.holds(outbox_id):
+            continue
+        
+        webhook_url = registry.webhook_url(item["channel_id"]) if DELIVERY_WEBHOOKS else None
+        delivery.enqueue(
+            item["channel_id"],
+            embeds[item["tweet_id"]],
+            f"tweet {item['tweet_id']} from {item['twitter_username']}",
+            webhook_url,
+            f"@{item['twitter_username']}",
+            outbox_id
+        )
+    
+    return True
+
+async def replay_outbox():
+    """
+    Queue the deliveries that the previous run recorded but did not send,
+    with the attempts made so far; failed ones stay on the slow retry interval
+    """
+    pending = [row for row in await db.get_pending_outbox() if not delivery.holds(row["id"])]
+    for row in pending:
+        webhook_url = registry.webhook_url(row["channel_id"]) if DELIVERY_WEBHOOKS else None
+        delivery.enqueue(
+            row["channel_id"],
+            discord.Embed.from_dict(row["payload"]),
+            f"tweet {row['tweet_id']} from {row['twitter_username']}",
+            webhook_url,
+            f"@{row['twitter_username']}",
+            row["id"],
+            row["attempts"],
+            row["status"] == "failed"
+        )
+    
+    if pending:
+        logger.info(f"Replaying {len(pending)} undelivered tweets from the outbox")
+
+async def deliver_streamed_tweets(username, tweets):
+    """
+    Deliver tweets received from the filtered stream
+    
+    Args:
+        username (str): Author username as reported by the stream
+        tweets (list): Tweets in posting order
+    """
+    # The stream reports the canonical handle, subscriptions keep the spelling used in !track
+    tweets_by_username = {
+        tracked_username: tweets
+        for tracked_username in registry.usernames()
+        if tracked_username.lower() == username.lower()
+    }
+    if not await deliver_tweets(tweets_by_username):
+        return
+    
+    # Advance the watermarks so that polls do not fetch these tweets again. Only
+    # when the connection has been up since the last poll: otherwise the stream
+    # may have missed tweets before these, which the next poll must still find.
+    connected_since = stream.connected_since
+    for tracked_username, tweets in tweets_by_username.items():
+        scheduler.record_streamed(tracked_username, len(tweets))
+        newest = max(tweets, key=lambda tweet: int(tweet.id))
+        if connected_since is None or connected_since > since_ids_checked_at.get(tracked_username, 0):
+            continue
+        if int(newest.id) > int(since_ids.get(tracked_username) or 0):
+            since_ids[tracked_username] = str(newest.id)
+            await db.update_since_id(tracked_username, newest.id)
+
+stream = StreamIngestion(twitter, deliver_streamed_tweets) if STREAM_ENABLED else None
+
+@tasks.loop(seconds=POLL_TICK_INTERVAL)
 async def check_new_tweets():
-    """Background task to check for new tweets from tracked accounts"""
+    """Background task to check for new tweets from tracked accounts that are due for a poll"""
+    global stream_was_healthy
     try:
-        # Get all tracked accounts
-        tracked_accounts = db.get_tracked_accounts()
+        if not registry.loaded or time.time() - subscriptions_refreshed_at >= SUBSCRIPTION_REFRESH_INTERVAL:
+            await refresh_subscriptions()
         
-        if not tracked_accounts:
+        # Fall back to adaptive polling as soon as the stream goes down
+        stream_healthy = stream is not None and stream.healthy
+        if stream_was_healthy and not stream_healthy:
+            logger.warning("Twitter filtered stream is down, falling back to polling")
+            scheduler.resume()
+        stream_was_healthy = stream_healthy
+        
+        usernames = scheduler.due()
+        if not usernames:
             return
         
-        # Group accounts by guild_id and channel_id
-        accounts_by_channel = {}
-        for account in tracked_accounts:
-            guild_id = account["guild_id"]
-            channel_id = account["channel_id"]
-            username = account["twitter_username"]
-            
-            # Skip accounts tracked via webhook
-            if guild_id == "webhook" or channel_id == "webhook":
-                continue
-            
-            key = f"{guild_id}:{channel_id}"
-            if key not in accounts_by_channel:
-                accounts_by_channel[key] = []
-            
-            accounts_by_channel[key].append(username)
+        # In search mode accounts with a watermark share packed search queries;
+        # accounts that were never polled start from their own timeline
+        if INGESTION_MODE == "search":
+            searched = [username for username in usernames if since_ids.get(username)]
+        else:
+            searched = []
+        single = [username for username in usernames if username not in searched]
         
-        # Check for new tweets for each channel
-        for key, usernames in accounts_by_channel.items():
-            guild_id, channel_id = key.split(":")
-            channel = bot.get_channel(int(channel_id))
-            
-            if not channel:
-                logger.warning(f"Channel {channel_id} not found")
-                continue
-            
-            for username in usernames:
-                # Get recent tweets
-                tweets = twitter.get_recent_tweets(username, max_results=5)
-                
-                for tweet in tweets:
-                    # Skip if tweet is already cached
-                    if db.is_tweet_cached(tweet.id):
-                        continue
-                    
-                    # Cache the tweet
-                    db.cache_tweet(tweet.id, username)
-                    
-                    try:
-                        # Send tweet to Discord
-                        embed = create_tweet_embed(tweet, username)
-                        await channel.send(embed=embed)
-                        logger.info(f"Sent tweet {tweet.id} from {username} to channel {channel_id}")
-                    except discord.HTTPException as e:
-                        logger.error(f"HTTP error sending tweet {tweet.id}: {e}")
-                    except Exception as e:
-                        logger.error(f"Error sending tweet {tweet.id}: {e}")
-                    
-                    # Add a small delay to avoid rate limits
-                    await asyncio.sleep(1)
+        # Check for new tweets of the due accounts, several requests at a time
+        semaphore = asyncio.Semaphore(POLL_CONCURRENCY)
+        polled_at = time.time()
+        started = asyncio.get_running_loop().time()
+        single_results, search_results = await asyncio.gather(
+            asyncio.gather(*[fetch_new_tweets(username, semaphore) for username in single]),
+            asyncio.gather(*[fetch_new_tweets_by_search(group, semaphore) for group in pack_usernames(searched)])
+        )
+        elapsed = asyncio.get_running_loop().time() - started
+        logger.info(f"Fetched {len(usernames)} accounts in {elapsed:.1f}s (concurrency {POLL_CONCURRENCY}, mode {INGESTION_MODE})")
+        
+        results = dict(zip(single, single_results))
+        for group_results in search_results:
+            results.update(group_results)
+        
+        # Schedule the next poll of every account from its posting activity.
+        # While the stream delivers tweets, polls are only a rare safety net.
+        for username, tweets in results.items():
+            if tweets is not None:
+                scheduler.record_poll(username, len(tweets))
+                # Only accounts the stream rules actually cover; the others keep polling
+                if stream_healthy and username in stream.usernames:
+                    scheduler.postpone(username, STREAM_SAFETY_POLL_INTERVAL)
+        await db.mark_polled([username for username, tweets in results.items() if tweets is not None])
+        
+        # Fan out new tweets of all polled accounts to the subscribed channels
+        new_tweets = {username: tweets for username, tweets in results.items() if tweets}
+        if new_tweets and not await deliver_tweets(new_tweets):
+            return
+        
+        # Advance the watermarks past the delivered tweets; the stream may have moved them further already
+        for username, tweets in new_tweets.items():
+            if int(tweets[-1].id) > int(since_ids.get(username) or 0):
+                since_ids[username] = str(tweets[-1].id)
+                await db.update_since_id(username, tweets[-1].id)
+        
+        # Everything up to the start of this poll is delivered now
+        for username, tweets in results.items():
+            if tweets is not None:
+                since_ids_checked_at[username] = polled_at
     
     except Exception as e:
         logger.error(f"Error in check_new_tweets task: {e}")
@@ -160,15 +543,72 @@ async def check_new_tweets():
 async def before_check_new_tweets():
     """Wait until the bot is ready before starting the task"""
     await bot.wait_until_ready()
+    
+    # Answer most dedup checks from memory from the first poll on
+    loaded = await db.warm_seen_tweets()
+    logger.info(f"Loaded {loaded} recently delivered tweet IDs into the seen-tweet index")
+    
+    # Send what the previous run left in the outbox, through the current webhooks
+    try:
+        await refresh_subscriptions()
+        await replay_outbox()
+    except Exception as e:
+        logger.error(f"Error replaying the outbox: {e}")
+
+@tasks.loop(seconds=CACHE_PRUNE_INTERVAL)
+async def prune_cached_tweets():
+    """Background task to delete processed tweets past the retention horizon"""
+    try:
+        deleted = await db.prune_cached_tweets()
+        if deleted:
+            logger.info(f"Pruned {deleted} old tweets from the tweet cache")
+        
+        deleted = await db.prune_outbox()
+        if deleted:
+            logger.info(f"Pruned {deleted} old failed deliveries from the outbox")
+    except Exception as e:
+        logger.error(f"Error in prune_cached_tweets task: {e}")
+
+@prune_cached_tweets.before_loop
+async def before_prune_cached_tweets():
+    """Wait until the bot is ready before starting the task"""
+    await bot.wait_until_ready()
+
+async def get_channel_webhook(channel):
+    """
+    Find the bot's webhook in a channel, creating it if there is none
+    
+    Args:
+        channel (discord.abc.GuildChannel): Channel the tweets are sent to
+    
+    Returns:
+        str: Webhook URL, or None if the bot may not manage webhooks there
+    """
+    # Threads and some channel types have no webhooks of their own
+    if not hasattr(channel, "create_webhook"):
+        return None
+    
+    try:
+        for webhook in await channel.webhooks():
+            if webhook.user and webhook.user.id == bot.user.id and webhook.token:
+                return webhook.url
+        
+        webhook = await channel.create_webhook(name=WEBHOOK_NAME, reason="TweetSync delivery")
+        return webhook.url
+    except discord.Forbidden:
+        logger.info(f"No permission to manage webhooks in channel {channel.id}, tweets will be sent by the bot")
+    except discord.HTTPException as e:
+        logger.warning(f"Could not set up a webhook in channel {channel.id}: {e}")
+    return None
 
 @bot.command(name="track")
-async def track_account(ctx, username: str = None):
+async def track_account(ctx, *usernames: str):
     """
-    Track a Twitter account and send new tweets to the current channel
+    Track one or more Twitter accounts and send new tweets to the current channel
     
     Args:
         ctx (discord.ext.commands.Context): Command context
-        username (str, optional): Twitter username to track
+        usernames (str): Twitter usernames to track
     """
     try:
         # Check permissions
@@ -177,39 +617,64 @@ async def track_account(ctx, username: str = None):
             return
         
         # Check if username is provided
-        if not username:
+        if not usernames:
             await ctx.send("Пожалуйста, укажите имя пользователя Twitter для отслеживания.")
             return
         
         # Remove @ if present
-        if username.startswith("@"):
-            username = username[1:]
+        usernames = list(dict.fromkeys(username.lstrip("@") for username in usernames))
         
-        # Check if the Twitter account exists
-        user = twitter.get_user_by_username(username)
-        if not user:
-            await ctx.send(f"Аккаунт Twitter @{username} не найден.")
+        # Check if the Twitter accounts exist with one lookup per 100 names;
+        # the canonical spelling of the handle is stored
+        users = await twitter.get_users_by_usernames(usernames)
+        if users is None:
+            await ctx.send("Не удалось проверить аккаунты Twitter, попробуйте позже.")
             return
         
-        # Add to tracked accounts
-        result = db.add_tracked_account(username, ctx.guild.id, ctx.channel.id)
+        not_found = [username for username in usernames if username.lower() not in users]
+        if not_found:
+            handles = ", ".join(f"@{username}" for username in not_found)
+            await ctx.send(f"Аккаунт Twitter {handles} не найден.")
+            return
+        
+        user_ids = {users[username.lower()].username: users[username.lower()].id for username in usernames}
+        usernames = list(user_ids)
+        
+        # Tweets are posted through a channel webhook when the bot may create one
+        webhook_url = await get_channel_webhook(ctx.channel) if DELIVERY_WEBHOOKS else None
+        
+        # Add to tracked accounts, keyed by Twitter user ID
+        result = await db.add_tracked_accounts(usernames, ctx.guild.id, ctx.channel.id, user_ids, webhook_url)
         
         if result and "error" in result:
             await ctx.send(result["error"])
             return
         
+        # Start polling the accounts on the next scheduler tick
+        registry.apply(result["accounts"])
+        await sync_subscriptions()
+        
         # Send confirmation
+        handles = ", ".join(f"@{username}" for username in usernames)
         embed = create_embed(
             title="Аккаунт Twitter добавлен для отслеживания",
-            description=f"Теперь отслеживаются твиты от @{username} в этом канале.",
+            description=f"Теперь отслеживаются твиты от {handles} в этом канале.",
             color=discord.Color.green(),
-            thumbnail="https://abs.twimg.com/icons/apple-touch-icon-192x192.png"
+            thumbnail=TWITTER_ICON_URL
         )
         
         await ctx.send(embed=embed)
         
-        # Get and send the most recent tweet as a preview
-        tweets = twitter.get_recent_tweets(username, max_results=1)
+        # Get and send the most recent tweet as a preview when a single account was added
+        if len(usernames) != 1:
+            return
+        
+        username = usernames[0]
+        try:
+            tweets = await twitter.get_recent_tweets(username, max_results=1)
+        except Exception as e:
+            logger.warning(f"Could not fetch a preview tweet for {username}: {e}")
+            return
         if tweets:
             tweet = tweets[0]
             try:
@@ -218,18 +683,21 @@ async def track_account(ctx, username: str = None):
             except discord.HTTPException as e:
                 logger.error(f"HTTP error sending preview tweet: {e}")
                 await ctx.send("Не удалось отобразить последний твит из-за ошибки Discord API.")
+    except RateLimitDeferred as e:
+        logger.warning(f"Twitter rate limit in track_account command: {e}")
+        await ctx.send(f"Лимит запросов к Twitter API исчерпан, попробуйте снова через {int(e.retry_after // 60) + 1} мин.")
     except Exception as e:
         logger.error(f"Error in track_account command: {e}")
         await ctx.send(f"Произошла ошибка при выполнении команды: {str(e)[:1000]}")
 
 @bot.command(name="untrack")
-async def untrack_account(ctx, username: str = None):
+async def untrack_account(ctx, *usernames: str):
     """
-    Stop tracking a Twitter account
+    Stop tracking one or more Twitter accounts
     
     Args:
         ctx (discord.ext.commands.Context): Command context
-        username (str, optional): Twitter username to untrack
+        usernames (str): Twitter usernames to untrack
     """
     try:
         # Check permissions
@@ -238,27 +706,36 @@ async def untrack_account(ctx, username: str = None):
             return
         
         # Check if username is provided
-        if not username:
+        if not usernames:
             await ctx.send("Пожалуйста, укажите имя пользователя Twitter для прекращения отслеживания.")
             return
         
         # Remove @ if present
-        if username.startswith("@"):
-            username = username[1:]
+        usernames = list(dict.fromkeys(username.lstrip("@") for username in usernames))
+        
+        # Remove from tracked accounts in a single request
+        removed = await db.remove_tracked_accounts(usernames, ctx.guild.id)
         
-        # Remove from tracked accounts
-        result = db.remove_tracked_account(username, ctx.guild.id)
+        # Handles are case-insensitive, removed ones come back as stored
+        removed_handles = {username.lower() for username in removed}
+        not_tracked = [username for username in usernames if username.lower() not in removed_handles]
+        if not_tracked:
+            handles = ", ".join(f"@{username}" for username in not_tracked)
+            await ctx.send(f"Аккаунт Twitter {handles} не отслеживается на этом сервере.")
         
-        if not result:
-            await ctx.send(f"Аккаунт Twitter @{username} не отслеживается на этом сервере.")
+        if not removed:
             return
         
+        registry.remove(removed, ctx.guild.id)
+        await sync_subscriptions()
+        
         # Send confirmation
+        handles = ", ".join(f"@{username}" for username in removed)
         embed = create_embed(
             title="Отслеживание аккаунта Twitter прекращено",
-            description=f"Больше не отслеживаются твиты от @{username} на этом сервере.",
+            description=f"Больше не отслеживаются твиты от {handles} на этом сервере.",
             color=discord.Color.red(),
-            thumbnail="https://abs.twimg.com/icons/apple-touch-icon-192x192.png"
+            thumbnail=TWITTER_ICON_URL
         )
         
         await ctx.send(embed=embed)
@@ -275,8 +752,14 @@ async def list_tracked_accounts(ctx):
         ctx (discord.ext.commands.Context): Command context
     """
     try:
-        # Get tracked accounts for this guild
-        accounts = db.get_tracked_accounts(ctx.guild.id)
+        # Get tracked accounts for this guild, from memory once the registry is loaded
+        if registry.loaded:
+            accounts = registry.for_guild(ctx.guild.id)
+        else:
+            accounts = await db.get_tracked_accounts(ctx.guild.id)
+            if accounts is None:
+                await ctx.send("Не удалось получить список отслеживаемых аккаунтов, попробуйте позже.")
+                return
         
         if not accounts:
             await ctx.send("На этом сервере не отслеживаются аккаунты Twitter.")
@@ -298,7 +781,7 @@ async def list_tracked_accounts(ctx):
             title="Отслеживаемые аккаунты Twitter",
             description=f"Аккаунты Twitter, отслеживаемые на сервере {ctx.guild.name}",
             color=discord.Color.blue(),
-            thumbnail="https://abs.twimg.com/icons/apple-touch-icon-192x192.png"
+            thumbnail=TWITTER_ICON_URL
         )
         
         # Add fields for each channel
@@ -335,16 +818,16 @@ async def help_command(ctx):
             title="TweetSync Bot - Справка",
             description="Команды для управления отслеживанием аккаунтов Twitter",
             color=discord.Color.blue(),
-            thumbnail="https://abs.twimg.com/icons/apple-touch-icon-192x192.png",
+            thumbnail=TWITTER_ICON_URL,
             fields=[
                 {
-                    "name": "!track <username>",
-                    "value": "Начать отслеживание аккаунта Twitter в текущем канале",
+                    "name": "!track <username> [username ...]",
+                    "value": "Начать отслеживание аккаунтов Twitter в текущем канале",
                     "inline": False
                 },
                 {
-                    "name": "!untrack <username>",
-                    "value": "Прекратить отслеживание аккаунта Twitter на этом сервере",
+                    "name": "!untrack <username> [username ...]",
+                    "value": "Прекратить отслеживание аккаунтов Twitter на этом сервере",
                     "inline": False
                 },
                 {
@@ -352,6 +835,11 @@ async def help_command(ctx):
                     "value": "Показать все отслеживаемые аккаунты Twitter на этом сервере",
                     "inline": False
                 },
+                {
+                    "name": "!stats",
+                    "value": "Показать показатели производительности бота",
+                    "inline": False
+                },
                 {
                     "name": "!ping",
                     "value": "Проверить, работает ли бот",
@@ -384,11 +872,23 @@ async def on_command_error(ctx, error):
     logger.error(f"Command error: {error}")
     await ctx.send(f"Произошла ошибка при выполнении команды: {str(error)[:1000]}")
 
+async def run_bot():
+    """Run the bot until it is closed, then stop the stream and the delivery workers"""
+    async with bot:
+        try:
+            await bot.start(TOKEN)
+        finally:
+            if stream:
+                stream.stop()
+            await delivery.stop()
+
 # Run the bot
 if __name__ == "__main__":
     try:
         logger.info("Запуск Discord бота")
-        bot.run(TOKEN, log_handler=None)
+        asyncio.run(run_bot())
+    except KeyboardInterrupt:
+        logger.info("Бот остановлен")
     except discord.LoginFailure as e:
         logger.error(f"Ошибка авторизации Discord: {e}")
         logger.error("Проверьте ваш токен бота в файле .env")
@@ -403,4 +903,8 @@ if __name__ == "__main__":
     except Exception as e:
         logger.error(f"Необработанная ошибка: {e}")
         logger.error(traceback.format_exc())
-        sys.exit(1) 
\ No newline at end of file
+        sys.exit(1)
+    finally:
+        # Write queued tweet cache entries and watermarks before exiting;
+        # the stream and the delivery workers were stopped inside the event loop
+        storage.close() 
\ No newline at end of file
@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 """
 Скрипт для создания необходимых таблиц в базе данных Supabase
+
+С флагом --migrate переносит подписки из старой таблицы tracked_accounts
+в twitter_accounts и subscriptions.
 """
 import os
 import sys
-import requests
 import json
 from dotenv import load_dotenv
 
+from db import create_session
+
 # Загружаем переменные окружения
 load_dotenv()
 
@@ -15,6 +19,31 @@ load_dotenv()
 supabase_url = os.getenv("SUPABASE_URL")
 supabase_key = os.getenv("SUPABASE_KEY")
 
+# Токен Twitter API нужен миграции, чтобы заполнить user_id аккаунтов
+bearer_token = os.getenv("TWITTER_BEARER_TOKEN")
+
+# Сессия с пулом keep-alive соединений, таймаутом и повтором запросов
+session = create_session()
+
+# Переносит подписки из старой таблицы tracked_accounts в twitter_accounts и subscriptions.
+# Старая таблица остается, ее можно удалить после проверки работы бота.
+MIGRATE_TRACKED_ACCOUNTS_SQL = """
+DO $$
+BEGIN
+    IF to_regclass('public.tracked_accounts') IS NOT NULL AND NOT EXISTS (SELECT 1 FROM twitter_accounts) THEN
+        INSERT INTO twitter_accounts (handle, since_id)
+            SELECT twitter_username, MAX(since_id::BIGINT) FROM tracked_accounts
+            WHERE guild_id <> 'webhook' AND channel_id <> 'webhook'
+            GROUP BY twitter_username;
+        INSERT INTO subscriptions (account_id, guild_id, channel_id)
+            SELECT a.id, t.guild_id::BIGINT, t.channel_id::BIGINT
+            FROM tracked_accounts t JOIN twitter_accounts a ON a.handle = t.twitter_username
+            WHERE t.guild_id <> 'webhook' AND t.channel_id <> 'webhook'
+            ON CONFLICT (account_id, guild_id) DO NOTHING;
+    END IF;
+END $$;
+"""
+
 def create_table(table_name, schema):
     """
     Создает таблицу в Supabase через REST API
@@ -36,7 +65,7 @@ def create_table(table_name, schema):
     # Проверяем существование таблицы
     check_url = f"{supabase_url}/rest/v1/{table_name}?limit=1"
     try:
-        response = requests.get(check_url, headers=headers)
+        response = session.get(check_url, headers=headers)
         if response.status_code == 200:
             print(f"Таблица {table_name} уже существует.")
             return True
@@ -49,31 +78,39 @@ def create_table(table_name, schema):
         sql_url = f"{supabase_url}/rest/v1/rpc/exec_sql"
         payload = {"query": schema}
         
-        response = requests.post(sql_url, headers=headers, json=payload)
+        response = session.post(sql_url, headers=headers, json=payload)
         
         # Если API exec_sql не существует, пробуем альтернативный метод
         if response.status_code == 404:
             print(f"API exec_sql не найден. Пробуем создать таблицу напрямую...")
             
             # Создаем таблицу через POST запрос
-            # Для tracked_accounts
-            if table_name == "tracked_accounts":
-                create_url = f"{supabase_url}/rest/v1/tracked_accounts"
+            # Для twitter_accounts
+            if table_name == "twitter_accounts":
+                create_url = f"{supabase_url}/rest/v1/twitter_accounts"
                 payload = {
-                    "twitter_username": "test_user",
-                    "guild_id": "test_guild",
-                    "channel_id": "test_channel"
+                    "handle": "test_user"
                 }
-                response = requests.post(create_url, headers=headers, json=payload)
+                response = session.post(create_url, headers=headers, json=payload)
                 
                 # Если таблица успешно создана или существует, удаляем тестовую запись
                 if response.status_code in [201, 409]:
                     print(f"Таблица {table_name} создана успешно.")
                     # Удаляем тестовую запись
-                    delete_url = f"{supabase_url}/rest/v1/tracked_accounts?twitter_username=eq.test_user"
-                    requests.delete(delete_url, headers=headers)
+                    delete_url = f"{supabase_url}/rest/v1/twitter_accounts?handle=eq.test_user"
+                    session.delete(delete_url, headers=headers)
                     return True
             
+            # Для subscriptions тестовую запись не создать без аккаунта, нужна схема из supabase_setup.sql
+            elif table_name == "subscriptions":
+                print(f"Создайте таблицу {table_name}, выполнив supabase_setup.sql в SQL редакторе Supabase.")
+                return False
+            
+            # Для outbox тестовая запись не нужна, схема в supabase_setup.sql
+            elif table_name == "outbox":
+                print(f"Создайте таблицу {table_name}, выполнив supabase_setup.sql в SQL редакторе Supabase.")
+                return False
+            
             # Для cached_tweets
             elif table_name == "cached_tweets":
                 create_url = f"{supabase_url}/rest/v1/cached_tweets"
@@ -81,14 +118,14 @@ def create_table(table_name, schema):
                     "tweet_id": "test_id",
                     "twitter_username": "test_user"
                 }
-                response = requests.post(create_url, headers=headers, json=payload)
+                response = session.post(create_url, headers=headers, json=payload)
                 
                 # Если таблица успешно создана или существует, удаляем тестовую запись
                 if response.status_code in [201, 409]:
                     print(f"Таблица {table_name} создана успешно.")
                     # Удаляем тестовую запись
                     delete_url = f"{supabase_url}/rest/v1/cached_tweets?tweet_id=eq.test_id"
-                    requests.delete(delete_url, headers=headers)
+                    session.delete(delete_url, headers=headers)
                     return True
         
         elif response.status_code == 200:
@@ -102,6 +139,125 @@ def create_table(table_name, schema):
         print(f"Ошибка при создании таблицы {table_name}: {e}")
         return False
 
+def get_headers():
+    """
+    Возвращает заголовки для запросов к REST API Supabase
+    """
+    return {
+        "apikey": supabase_key,
+        "Authorization": f"Bearer {supabase_key}",
+        "Content-Type": "application/json",
+        "Prefer": "return=minimal"
+    }
+
+def migrate_tracked_accounts():
+    """
+    Переносит данные из tracked_accounts в twitter_accounts и subscriptions
+    и заполняет user_id перенесенных аккаунтов
+    
+    Returns:
+        bool: True если миграция выполнена успешно, False в противном случае
+    """
+    try:
+        response = session.post(
+            f"{supabase_url}/rest/v1/rpc/exec_sql",
+            headers=get_headers(),
+            json={"query": MIGRATE_TRACKED_ACCOUNTS_SQL}
+        )
+        if response.status_code == 404:
+            print("API exec_sql не найден. Выполните блок миграции из supabase_setup.sql в SQL редакторе Supabase")
+            print("и запустите python create_tables.py --migrate еще раз, чтобы заполнить user_id.")
+        elif response.status_code not in [200, 204]:
+            print(f"Ошибка при переносе tracked_accounts: {response.text}")
+            return False
+    except Exception as e:
+        print(f"Ошибка при переносе tracked_accounts: {e}")
+        return False
+    
+    return resolve_user_ids()
+
+def resolve_user_ids():
+    """
+    Заполняет user_id аккаунтов, у которых известен только handle (перенесенных
+    из tracked_accounts), и записывает каноническое написание имени из Twitter.
+    Бот ищет аккаунты по user_id, поэтому команду нужно выполнить до первого !track
+    
+    Returns:
+        bool: True если все найденные аккаунты обновлены, False в противном случае
+    """
+    # Читаем аккаунты без user_id постранично по первичному ключу
+    accounts = []
+    last_id = 0
+    try:
+        while True:
+            response = session.get(
+                f"{supabase_url}/rest/v1/twitter_accounts?select=id,handle&user_id=is.null"
+                f"&id=gt.{last_id}&order=id&limit=1000",
+                headers=get_headers()
+            )
+            if response.status_code != 200:
+                print(f"Ошибка при чтении twitter_accounts: {response.text}")
+                return False
+            page = response.json()
+            if not page:
+                break
+            accounts.extend(page)
+            last_id = page[-1]["id"]
+    except Exception as e:
+        print(f"Ошибка при чтении twitter_accounts: {e}")
+        return False
+    
+    print(f"Аккаунтов без user_id: {len(accounts)}")
+    if not accounts:
+        return True
+    if not bearer_token:
+        print("TWITTER_BEARER_TOKEN не указан, укажите его и запустите python create_tables.py --migrate еще раз.")
+        return False
+    
+    import tweepy
+    client = tweepy.Client(bearer_token=bearer_token, wait_on_rate_limit=True)
+    
+    resolved = 0
+    ok = True
+    # Twitter API принимает до 100 имен пользователей за запрос
+    for start in range(0, len(accounts), 100):
+        batch = accounts[start:start + 100]
+        try:
+            response = client.get_users(usernames=[account["handle"] for account in batch])
+        except Exception as e:
+            print(f"Ошибка при получении пользователей Twitter: {e}")
+            ok = False
+            continue
+        
+        users = {user.username.lower(): user for user in response.data or []}
+        for account in batch:
+            user = users.get(account["handle"].lower())
+            if user is None:
+                print(f"Пользователь Twitter {account['handle']} не найден")
+                continue
+            
+            try:
+                response = session.patch(
+                    f"{supabase_url}/rest/v1/twitter_accounts?id=eq.{account['id']}",
+                    headers=get_headers(),
+                    json={"user_id": user.id, "handle": user.username}
+                )
+                if response.status_code in [200, 204]:
+                    resolved += 1
+                elif response.status_code == 409:
+                    print(f"Аккаунт {account['handle']} уже добавлен ботом отдельной записью, "
+                          f"перенесенные подписки остались у записи id={account['id']}")
+                    ok = False
+                else:
+                    print(f"Ошибка при обновлении аккаунта {account['handle']}: {response.text}")
+                    ok = False
+            except Exception as e:
+                print(f"Ошибка при обновлении аккаунта {account['handle']}: {e}")
+                ok = False
+    
+    print(f"Заполнено user_id: {resolved}")
+    return ok
+
 def main():
     """
     Создает необходимые таблицы в базе данных Supabase
@@ -114,16 +270,54 @@ def main():
         print("Убедитесь, что в файле .env указаны SUPABASE_URL и SUPABASE_KEY")
         return
     
-    # SQL-запрос для создания таблицы tracked_accounts
-    create_tracked_accounts_table = """
-    CREATE TABLE IF NOT EXISTS tracked_accounts (
-        id SERIAL PRIMARY KEY,
-        twitter_username TEXT NOT NULL,
-        guild_id TEXT NOT NULL,
-        channel_id TEXT NOT NULL,
+    # SQL-запрос для создания таблицы twitter_accounts
+    create_twitter_accounts_table = """
+    CREATE TABLE IF NOT EXISTS twitter_accounts (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT UNIQUE,
+        handle TEXT NOT NULL,
+        handle_lower TEXT GENERATED ALWAYS AS (lower(handle)) STORED,
+        since_id BIGINT,
+        last_polled TIMESTAMP WITH TIME ZONE,
         created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-        UNIQUE(twitter_username, guild_id)
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
     );
+    ALTER TABLE twitter_accounts ADD COLUMN IF NOT EXISTS handle_lower TEXT GENERATED ALWAYS AS (lower(handle)) STORED;
+    CREATE INDEX IF NOT EXISTS idx_twitter_accounts_handle_lower ON twitter_accounts(handle_lower);
+    DROP INDEX IF EXISTS idx_twitter_accounts_handle;
+    CREATE OR REPLACE FUNCTION set_updated_at() RETURNS TRIGGER AS $$
+    BEGIN
+        NEW.updated_at = NOW();
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    DROP TRIGGER IF EXISTS twitter_accounts_set_updated_at ON twitter_accounts;
+    CREATE TRIGGER twitter_accounts_set_updated_at
+        BEFORE UPDATE ON twitter_accounts
+        FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+    """
+    
+    # SQL-запрос для создания таблицы subscriptions
+    create_subscriptions_table = """
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        id BIGSERIAL PRIMARY KEY,
+        account_id BIGINT NOT NULL REFERENCES twitter_accounts(id) ON DELETE CASCADE,
+        guild_id BIGINT NOT NULL,
+        channel_id BIGINT NOT NULL,
+        webhook_url TEXT,
+        options JSONB NOT NULL DEFAULT '{}',
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+        UNIQUE(account_id, guild_id)
+    );
+    ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS webhook_url TEXT;
+    CREATE INDEX IF NOT EXISTS idx_subscriptions_guild_id ON subscriptions(guild_id) INCLUDE (account_id, channel_id);
+    CREATE INDEX IF NOT EXISTS idx_subscriptions_account_id ON subscriptions(account_id) INCLUDE (guild_id, channel_id);
+    CREATE INDEX IF NOT EXISTS idx_subscriptions_updated_at ON subscriptions(updated_at);
+    DROP TRIGGER IF EXISTS subscriptions_set_updated_at ON subscriptions;
+    CREATE TRIGGER subscriptions_set_updated_at
+        BEFORE UPDATE ON subscriptions
+        FOR EACH ROW EXECUTE FUNCTION set_updated_at();
     """
     
     # SQL-запрос для создания таблицы cached_tweets
@@ -135,15 +329,45 @@ def main():
         created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
         UNIQUE(tweet_id)
     );
+    CREATE INDEX IF NOT EXISTS idx_cached_tweets_twitter_username_id ON cached_tweets(twitter_username, id);
+    CREATE INDEX IF NOT EXISTS idx_cached_tweets_created_at ON cached_tweets(created_at);
+    DROP INDEX IF EXISTS idx_cached_tweets_tweet_id;
+    DROP INDEX IF EXISTS idx_cached_tweets_twitter_username;
+    """
+    
+    # SQL-запрос для создания таблицы outbox
+    create_outbox_table = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id BIGSERIAL PRIMARY KEY,
+        tweet_id TEXT NOT NULL,
+        twitter_username TEXT NOT NULL,
+        channel_id BIGINT NOT NULL,
+        payload JSONB NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+        UNIQUE(tweet_id, channel_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_outbox_status_id ON outbox(status, id);
     """
     
     # Создаем таблицы
-    print("Создание таблицы tracked_accounts...")
-    create_table("tracked_accounts", create_tracked_accounts_table)
+    print("Создание таблицы twitter_accounts...")
+    create_table("twitter_accounts", create_twitter_accounts_table)
+    
+    print("\nСоздание таблицы subscriptions...")
+    create_table("subscriptions", create_subscriptions_table)
     
     print("\nСоздание таблицы cached_tweets...")
     create_table("cached_tweets", create_cached_tweets_table)
     
+    print("\nСоздание таблицы outbox...")
+    create_table("outbox", create_outbox_table)
+    
+    if "--migrate" in sys.argv[1:]:
+        print("\nПеренос данных из tracked_accounts...")
+        migrate_tracked_accounts()
+    
     print("\nПроцесс создания таблиц завершен.")
     print("Теперь вы можете запустить бота с помощью команды:")
     print("./run_bot.sh" if os.name != 'nt' else "run_bot.bat")
@@ -2,6 +2,15 @@ import os
 import ssl
 import requests
 import json
+from urllib.parse import quote
+import time
+import atexit
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
 # Отключаем проверку SSL-сертификатов
@@ -10,7 +19,553 @@ ssl._create_default_https_context = ssl._create_unverified_context
 # Загружаем переменные окружения
 load_dotenv()
 
-class Database:
+# Настройки пула HTTP-соединений к Supabase
+db_pool_size = int(os.getenv("SUPABASE_POOL_SIZE", "16"))
+db_timeout = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+db_max_retries = int(os.getenv("SUPABASE_MAX_RETRIES", "3"))
+db_retry_backoff = float(os.getenv("SUPABASE_RETRY_BACKOFF", "0.5"))
+
+# Размер пачки для пакетных запросов: ID твитов в одном фильтре in.(...) и строк в одной вставке
+db_lookup_batch_size = int(os.getenv("SUPABASE_LOOKUP_BATCH_SIZE", "200"))
+db_insert_batch_size = int(os.getenv("SUPABASE_INSERT_BATCH_SIZE", "1000"))
+
+# Хранение кэша обработанных твитов: старше скольких дней удалять (0 - хранить всегда),
+# сколько последних твитов оставлять на аккаунт (0 - без ограничения) и сколько строк удалять за раз
+cached_tweets_retention_days = float(os.getenv("CACHED_TWEETS_RETENTION_DAYS", "30"))
+cached_tweets_per_account = int(os.getenv("CACHED_TWEETS_PER_ACCOUNT", "0"))
+cached_tweets_prune_batch_size = int(os.getenv("CACHED_TWEETS_PRUNE_BATCH_SIZE", "500"))
+
+# Отложенная запись (write-behind) кэша твитов и since_id: включена ли, как часто сбрасывать
+# очередь в базу (секунды), при скольких ожидающих записях сбрасывать сразу и предел паузы между повторами
+write_behind_enabled = os.getenv("DB_WRITE_BEHIND", "1") == "1"
+write_behind_interval = float(os.getenv("DB_WRITE_BEHIND_INTERVAL", "2"))
+write_behind_max_pending = int(os.getenv("DB_WRITE_BEHIND_MAX_PENDING", "500"))
+write_behind_max_backoff = float(os.getenv("DB_WRITE_BEHIND_MAX_BACKOFF", "60"))
+
+# Хранилище данных бота: "supabase" (по умолчанию) или "sqlite"
+storage_backend = os.getenv("STORAGE_BACKEND", "supabase").lower()
+
+# Сколько ID обработанных твитов держать в памяти
+seen_tweets_capacity = int(os.getenv("SEEN_TWEETS_CAPACITY", "100000"))
+
+# PostgREST по умолчанию отдает не больше 1000 строк за запрос
+DB_PAGE_SIZE = 1000
+
+# Столбцы подписки и ее аккаунта Twitter, которые нужны боту
+SUBSCRIPTION_SELECT = "id,account_id,guild_id,channel_id,webhook_url,options,updated_at,twitter_accounts(user_id,handle,since_id)"
+
+def flatten_subscription(row):
+    """
+    Превращает строку subscriptions со встроенным аккаунтом Twitter в плоскую
+    запись отслеживаемого аккаунта с прежними ключами (twitter_username,
+    guild_id, channel_id, since_id); ID передаются строками
+    
+    Args:
+        row (dict): Строка subscriptions с ключом twitter_accounts
+    
+    Returns:
+        dict: Отслеживаемый аккаунт
+    """
+    account = row["twitter_accounts"]
+    return {
+        "id": row["id"],
+        "account_id": row["account_id"],
+        "twitter_username": account["handle"],
+        "user_id": str(account["user_id"]) if account.get("user_id") else None,
+        "guild_id": str(row["guild_id"]),
+        "channel_id": str(row["channel_id"]),
+        "webhook_url": row.get("webhook_url"),
+        "since_id": str(account["since_id"]) if account.get("since_id") else None,
+        "options": row.get("options") or {},
+        "updated_at": row.get("updated_at")
+    }
+
+class PooledSession(requests.Session):
+    """
+    Сессия requests с таймаутом по умолчанию для всех запросов
+    """
+    
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+    
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+def create_session(pool_size=db_pool_size, timeout=db_timeout, max_retries=db_max_retries):
+    """
+    Создает HTTP-сессию с пулом keep-alive соединений и повтором неудачных запросов
+    
+    Args:
+        pool_size (int): Максимальное количество соединений в пуле
+        timeout (float): Таймаут запроса в секундах
+        max_retries (int): Количество повторов при сетевых ошибках и ответах 429/5xx
+    
+    Returns:
+        requests.Session: Настроенная сессия
+    """
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=db_retry_backoff,
+        status_forcelist=[429, 500, 502, 503, 504],
+        # POST не повторяется после отправки запроса, чтобы не создавать дубликаты
+        allowed_methods=frozenset(["HEAD", "GET", "PATCH", "DELETE"]),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    
+    session = PooledSession(timeout)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+class SeenTweetIndex:
+    """
+    Ограниченный по размеру LRU-набор ID обработанных твитов в памяти.
+    Если ID есть в индексе, твит точно обработан; если нет - нужно спросить базу.
+    """
+    
+    def __init__(self, capacity=seen_tweets_capacity):
+        self.capacity = capacity
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._ids)
+    
+    def __contains__(self, tweet_id):
+        key = str(tweet_id)
+        with self._lock:
+            if key not in self._ids:
+                return False
+            self._ids.move_to_end(key)
+            return True
+    
+    def add(self, tweet_ids):
+        """
+        Добавляет ID твитов в индекс, вытесняя самые давние
+        
+        Args:
+            tweet_ids (iterable): ID твитов
+        """
+        with self._lock:
+            for tweet_id in tweet_ids:
+                key = str(tweet_id)
+                self._ids[key] = None
+                self._ids.move_to_end(key)
+            while len(self._ids) > self.capacity:
+                self._ids.popitem(last=False)
+
+class WriteBehindQueue:
+    """
+    Очередь отложенной записи в хранилище. Добавления в кэш твитов, новые
+    since_id и отправленные записи outbox копятся в памяти, объединяются (для
+    аккаунта хранится только самый новый since_id) и записываются фоновым потоком пачками: раз в
+    DB_WRITE_BEHIND_INTERVAL секунд или сразу, когда накопилось
+    DB_WRITE_BEHIND_MAX_PENDING записей. Неудачная запись возвращается в
+    очередь и повторяется с растущей паузой.
+    """
+    
+    def __init__(self, storage, interval=write_behind_interval, max_pending=write_behind_max_pending):
+        self.storage = storage
+        self.interval = interval
+        self.max_pending = max_pending
+        self._tweets = {}  # ID твита -> имя пользователя Twitter
+        self._since_ids = {}  # имя пользователя Twitter -> since_id
+        self._polled = {}  # имя пользователя Twitter -> время последнего опроса
+        self._outbox_done = set()  # ID отправленных записей outbox
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        
+        self._thread = threading.Thread(target=self._run, name="tweetsync-write-behind", daemon=True)
+        self._thread.start()
+        
+        # Сбрасываем очередь и при выходе без явного close()
+        atexit.register(self.close)
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._tweets) + len(self._since_ids) + len(self._polled) + len(self._outbox_done)
+    
+    def add_tweets(self, tweets):
+        """
+        Ставит твиты в очередь на добавление в кэш
+        
+        Args:
+            tweets (list): Пары (ID твита, имя пользователя Twitter)
+        """
+        with self._lock:
+            for tweet_id, twitter_username in tweets:
+                self._tweets[str(tweet_id)] = twitter_username
+            pending = len(self._tweets) + len(self._since_ids)
+        
+        if pending >= self.max_pending:
+            self._wakeup.set()
+    
+    def set_since_id(self, twitter_username, since_id):
+        """
+        Ставит в очередь новый since_id аккаунта; более старые значения не записываются
+        
+        Args:
+            twitter_username (str): Имя пользователя Twitter
+            since_id (str): ID последнего обработанного твита
+        """
+        with self._lock:
+            current = self._since_ids.get(twitter_username)
+            if current is None or int(since_id) > int(current):
+                self._since_ids[twitter_username] = str(since_id)
+    
+    def set_polled(self, twitter_usernames, polled_at):
+        """
+        Ставит в очередь время последнего опроса аккаунтов
+        
+        Args:
+            twitter_usernames (iterable): Имена пользователей Twitter
+            polled_at (float): Время опроса (Unix time)
+        """
+        with self._lock:
+            for twitter_username in twitter_usernames:
+                self._polled[twitter_username] = max(polled_at, self._polled.get(twitter_username, 0))
+    
+    def complete_outbox(self, outbox_ids):
+        """
+        Ставит в очередь удаление отправленных записей outbox
+        
+        Args:
+            outbox_ids (iterable): ID записей outbox
+        """
+        with self._lock:
+            self._outbox_done.update(outbox_ids)
+            pending = len(self._outbox_done)
+        
+        if pending >= self.max_pending:
+            self._wakeup.set()
+    
+    def flush(self):
+        """
+        Записывает все ожидающие изменения в хранилище
+        
+        Returns:
+            bool: True если очередь записана полностью, False если что-то вернулось в очередь
+        """
+        with self._flush_lock:
+            with self._lock:
+                tweets, self._tweets = self._tweets, {}
+                since_ids, self._since_ids = self._since_ids, {}
+                polled, self._polled = self._polled, {}
+                outbox_done, self._outbox_done = self._outbox_done, set()
+            
+            success = True
+            
+            if tweets and not self.storage._insert_cached_tweets(list(tweets.items())):
+                success = False
+                with self._lock:
+                    for tweet_id, twitter_username in tweets.items():
+                        self._tweets.setdefault(tweet_id, twitter_username)
+            
+            if since_ids and not self.storage._store_since_ids(since_ids):
+                success = False
+                for twitter_username, since_id in since_ids.items():
+                    self.set_since_id(twitter_username, since_id)
+            
+            # Все аккаунты записываются одним запросом с самым поздним временем опроса
+            if polled and not self.storage._store_last_polled(list(polled), max(polled.values())):
+                success = False
+                with self._lock:
+                    for twitter_username, polled_at in polled.items():
+                        self._polled.setdefault(twitter_username, polled_at)
+            
+            if outbox_done and not self.storage._delete_outbox(list(outbox_done)):
+                success = False
+                with self._lock:
+                    self._outbox_done.update(outbox_done)
+            
+            return success
+    
+    def close(self):
+        """
+        Останавливает фоновый поток и записывает остаток очереди
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=self.interval + 5)
+        
+        if len(self) and not self.flush():
+            print(f"Не удалось записать в базу {len(self)} отложенных изменений при завершении")
+    
+    def _run(self):
+        backoff = 0
+        while not self._closed:
+            self._wakeup.wait(backoff or self.interval)
+            self._wakeup.clear()
+            if self._closed:
+                return
+            
+            try:
+                success = self.flush()
+            except Exception as e:
+                print(f"Ошибка при отложенной записи в базу: {e}")
+                success = False
+            
+            if success:
+                backoff = 0
+            else:
+                backoff = min(max(backoff * 2, self.interval), write_behind_max_backoff)
+                print(f"Отложенная запись в базу не удалась, повтор через {backoff:.0f} с")
+
+class Storage(ABC):
+    """
+    Интерфейс хранилища бота: отслеживаемые аккаунты, кэш обработанных твитов,
+    since_id аккаунтов и outbox неотправленных твитов. Реализации: Database
+    (Supabase REST API) и SQLiteDatabase (локальный файл SQLite, модуль sqlite_db).
+    
+    Добавления в кэш твитов, since_id и отметки об отправке из outbox по
+    умолчанию записываются через WriteBehindQueue, чтобы цикл опроса не ждал базу.
+    """
+    
+    def __init__(self):
+        self.write_queue = WriteBehindQueue(self) if write_behind_enabled else None
+    
+    def add_tracked_account(self, twitter_username, guild_id, channel_id, user_id=None):
+        """
+        Добавляет аккаунт Twitter в список отслеживаемых.
+        Если аккаунт уже отслеживается на сервере, обновляется канал назначения.
+        
+        Args:
+            twitter_username (str): Имя пользователя Twitter
+            guild_id (str): ID сервера Discord
+            channel_id (str): ID канала Discord
+            user_id (str, optional): ID пользователя Twitter
+        
+        Returns:
+            dict: Результат операции
+        """
+        user_ids = {twitter_username: user_id} if user_id else None
+        result = self.add_tracked_accounts([twitter_username], guild_id, channel_id, user_ids)
+        
+        if "error" in result:
+            return result
+        return {"message": f"Аккаунт @{twitter_username} добавлен для отслеживания."}
+    
+    @abstractmethod
+    def add_tracked_accounts(self, twitter_usernames, guild_id, channel_id, user_ids=None, webhook_url=None):
+        pass
+    
+    def remove_tracked_account(self, twitter_username, guild_id):
+        """
+        Удаляет аккаунт Twitter из списка отслеживаемых
+        
+        Args:
+            twitter_username (str): Имя пользователя Twitter
+            guild_id (str): ID сервера Discord
+        
+        Returns:
+            bool: True если аккаунт успешно удален, False в противном случае
+        """
+        return len(self.remove_tracked_accounts([twitter_username], guild_id)) > 0
+    
+    @abstractmethod
+    def remove_tracked_accounts(self, twitter_usernames, guild_id):
+        pass
+    
+    @abstractmethod
+    def iter_tracked_accounts(self, guild_id=None, updated_since=None, page_size=DB_PAGE_SIZE):
+        pass
+    
+    def get_tracked_accounts(self, guild_id=None):
+        """
+        Получает список отслеживаемых аккаунтов Twitter
+        
+        Args:
+            guild_id (str, optional): ID сервера Discord для фильтрации
+        
+        Returns:
+            list: Список отслеживаемых аккаунтов или None при ошибке
+        """
+        try:
+            return list(self.iter_tracked_accounts(guild_id=guild_id))
+        except Exception as e:
+            print(f"Ошибка при получении списка отслеживаемых аккаунтов: {e}")
+            return None
+    
+    def get_tracked_accounts_updated_since(self, updated_at):
+        """
+        Получает отслеживаемые аккаунты, добавленные или измененные начиная с момента updated_at.
+        Удаленные записи так не обнаружить, для этого нужна полная загрузка.
+        
+        Args:
+            updated_at (str): Значение updated_at самой свежей известной записи
+        
+        Returns:
+            list: Список измененных аккаунтов или None при ошибке
+        """
+        try:
+            return list(self.iter_tracked_accounts(updated_since=updated_at))
+        except Exception as e:
+            print(f"Ошибка при получении измененных отслеживаемых аккаунтов: {e}")
+            return None
+    
+    @abstractmethod
+    def get_cached_tweet_ids(self, tweet_ids):
+        pass
+    
+    def cache_tweets(self, tweets):
+        """
+        Добавляет много твитов в кэш обработанных твитов. При отложенной записи
+        твиты сразу попадают в индекс в памяти, а в базу - со следующим сбросом очереди.
+        
+        Args:
+            tweets (list): Пары (ID твита, имя пользователя Twitter)
+        
+        Returns:
+            bool: True если твиты добавлены (или поставлены в очередь), False в противном случае
+        """
+        if self.write_queue is None:
+            return self._insert_cached_tweets(tweets)
+        
+        tweets = list(tweets)
+        self.seen_tweets.add(tweet_id for tweet_id, _ in tweets)
+        self.write_queue.add_tweets(tweets)
+        return True
+    
+    @abstractmethod
+    def _insert_cached_tweets(self, tweets):
+        pass
+    
+    @abstractmethod
+    def warm_seen_tweets(self):
+        pass
+    
+    @abstractmethod
+    def prune_cached_tweets(self, retention_days=cached_tweets_retention_days, keep_per_account=cached_tweets_per_account):
+        pass
+    
+    def update_since_id(self, twitter_username, since_id):
+        """
+        Сохраняет ID последнего обработанного твита аккаунта (since_id),
+        при отложенной записи - со следующим сбросом очереди
+        
+        Args:
+            twitter_username (str): Имя пользователя Twitter
+            since_id (str): ID последнего обработанного твита
+        
+        Returns:
+            bool: True если значение сохранено (или поставлено в очередь), False в противном случае
+        """
+        if self.write_queue is None:
+            return self._store_since_ids({twitter_username: since_id})
+        
+        self.write_queue.set_since_id(twitter_username, since_id)
+        return True
+    
+    @abstractmethod
+    def _store_since_ids(self, since_ids):
+        pass
+    
+    def mark_polled(self, twitter_usernames):
+        """
+        Сохраняет время последнего опроса аккаунтов (last_polled),
+        при отложенной записи - со следующим сбросом очереди
+        
+        Args:
+            twitter_usernames (list): Имена пользователей Twitter
+        
+        Returns:
+            bool: True если значение сохранено (или поставлено в очередь), False в противном случае
+        """
+        if not twitter_usernames:
+            return True
+        if self.write_queue is None:
+            return self._store_last_polled(list(twitter_usernames), time.time())
+        
+        self.write_queue.set_polled(twitter_usernames, time.time())
+        return True
+    
+    @abstractmethod
+    def _store_last_polled(self, twitter_usernames, polled_at):
+        pass
+    
+    @abstractmethod
+    def add_outbox(self, deliveries):
+        pass
+    
+    @abstractmethod
+    def get_pending_outbox(self, page_size=DB_PAGE_SIZE):
+        pass
+    
+    def complete_outbox(self, outbox_ids):
+        """
+        Удаляет из outbox доставленные записи,
+        при отложенной записи - со следующим сбросом очереди
+        
+        Args:
+            outbox_ids (list): ID записей outbox
+        
+        Returns:
+            bool: True если записи удалены (или поставлены в очередь), False в противном случае
+        """
+        if not outbox_ids:
+            return True
+        if self.write_queue is None:
+            return self._delete_outbox(list(outbox_ids))
+        
+        self.write_queue.complete_outbox(outbox_ids)
+        return True
+    
+    @abstractmethod
+    def _delete_outbox(self, outbox_ids):
+        pass
+    
+    @abstractmethod
+    def fail_outbox(self, outbox_ids, attempts):
+        pass
+    
+    @abstractmethod
+    def prune_outbox(self, retention_days=cached_tweets_retention_days):
+        pass
+    
+    def flush(self):
+        """
+        Записывает в базу все отложенные изменения
+        
+        Returns:
+            bool: True если все изменения записаны
+        """
+        return self.write_queue.flush() if self.write_queue else True
+    
+    def close(self):
+        """
+        Записывает отложенные изменения и останавливает фоновую запись
+        """
+        if self.write_queue:
+            self.write_queue.close()
+
+def create_database(backend=None):
+    """
+    Создает хранилище, выбранное переменной окружения STORAGE_BACKEND
+    
+    Args:
+        backend (str, optional): "supabase" или "sqlite" вместо значения из окружения
+    
+    Returns:
+        Storage: Хранилище данных бота
+    """
+    backend = (backend or storage_backend).lower()
+    
+    if backend == "sqlite":
+        from sqlite_db import SQLiteDatabase
+        return SQLiteDatabase()
+    if backend == "supabase":
+        return Database()
+    
+    raise ValueError(f"Неизвестное хранилище STORAGE_BACKEND={backend}, допустимые значения: supabase, sqlite")
+
+class Database(Storage):
     def __init__(self):
         # Получаем учетные данные Supabase из переменных окружения
         self.supabase_url = os.getenv("SUPABASE_URL")
@@ -20,6 +575,12 @@ class Database:
         if not self.supabase_url or not self.supabase_key:
             raise ValueError("Не найдены учетные данные Supabase. Проверьте переменные SUPABASE_URL и SUPABASE_KEY в файле .env")
         
+        # Общая сессия с пулом соединений для всех запросов
+        self.session = create_session()
+        
+        # ID обработанных твитов в памяти, чтобы не ходить в базу за каждым
+        self.seen_tweets = SeenTweetIndex()
+        
         # Заголовки для запросов
         self.headers = {
             "apikey": self.supabase_key,
@@ -30,180 +591,667 @@ class Database:
         
         # Создаем таблицы, если они не существуют
         self._create_tables()
+        
+        super().__init__()
     
     def _create_tables(self):
         """
-        Создает необходимые таблицы в базе данных, если они не существуют
+        Проверяет, что таблицы в базе данных существуют
         """
         try:
             # Проверяем существование таблиц
-            tracked_accounts_url = f"{self.supabase_url}/rest/v1/tracked_accounts?limit=1"
-            cached_tweets_url = f"{self.supabase_url}/rest/v1/cached_tweets?limit=1"
+            missing = []
+            for table_name in ["twitter_accounts", "subscriptions", "cached_tweets", "outbox"]:
+                response = self.session.get(f"{self.supabase_url}/rest/v1/{table_name}?limit=1", headers=self.headers)
+                if response.status_code != 200:
+                    missing.append(table_name)
             
-            # Отправляем запросы для проверки существования таблиц
-            requests.get(tracked_accounts_url, headers=self.headers)
-            requests.get(cached_tweets_url, headers=self.headers)
+            if not missing:
+                print("Таблицы в базе данных уже существуют.")
+                
+                # Базы, созданные до поиска аккаунтов без учета регистра
+                response = self.session.get(
+                    f"{self.supabase_url}/rest/v1/twitter_accounts?select=handle_lower&limit=1", headers=self.headers
+                )
+                if response.status_code != 200:
+                    print("В таблице twitter_accounts нет столбца handle_lower. Выполните supabase_setup.sql в SQL редакторе Supabase.")
+                return
             
-            # Если запросы не вызвали ошибок, значит таблицы существуют
-            print("Таблицы в базе данных уже существуют.")
+            print(f"Не найдены таблицы: {', '.join(missing)}.")
+            print("Запустите скрипт create_tables.py для создания таблиц.")
+            print("Если бот работал со старой таблицей tracked_accounts, перенесите подписки командой python create_tables.py --migrate")
         except Exception as e:
-            print(f"Ошибка при создании таблиц: {e}")
-            print("Таблицы могут уже существовать или у вас нет прав на их создание.")
+            print(f"Ошибка при проверке таблиц: {e}")
             print("Если бот не работает, запустите скрипт create_tables.py для создания таблиц.")
     
-    def add_tracked_account(self, twitter_username, guild_id, channel_id):
+    def add_tracked_accounts(self, twitter_usernames, guild_id, channel_id, user_ids=None, webhook_url=None):
         """
-        Добавляет аккаунт Twitter в список отслеживаемых
+        Добавляет много аккаунтов Twitter в список отслеживаемых.
+        Аккаунты записываются в twitter_accounts (upsert по ID пользователя Twitter),
+        подписки сервера - в subscriptions одним upsert; для уже отслеживаемых
+        на сервере аккаунтов обновляются канал назначения и вебхук.
         
         Args:
-            twitter_username (str): Имя пользователя Twitter
+            twitter_usernames (list): Имена пользователей Twitter
             guild_id (str): ID сервера Discord
             channel_id (str): ID канала Discord
+            user_ids (dict, optional): Имя пользователя Twitter -> ID пользователя Twitter
+            webhook_url (str, optional): URL вебхука канала для отправки твитов
         
         Returns:
-            dict: Результат операции
+            dict: {"accounts": [...]} с сохраненными записями или {"error": ...}
         """
         try:
-            # Проверяем, существует ли уже такая запись
-            check_url = f"{self.supabase_url}/rest/v1/tracked_accounts?twitter_username=eq.{twitter_username}&guild_id=eq.{guild_id}"
-            response = requests.get(check_url, headers=self.headers)
-            
-            if response.status_code == 200 and len(response.json()) > 0:
-                # Запись уже существует
-                existing_record = response.json()[0]
-                
-                # Если канал отличается, обновляем запись
-                if existing_record["channel_id"] != str(channel_id):
-                    update_url = f"{self.supabase_url}/rest/v1/tracked_accounts?id=eq.{existing_record['id']}"
-                    payload = {"channel_id": str(channel_id)}
-                    
-                    response = requests.patch(update_url, headers=self.headers, json=payload)
-                    
-                    if response.status_code == 200:
-                        return {"message": f"Аккаунт @{twitter_username} уже отслеживается, обновлен канал назначения."}
-                    else:
-                        return {"error": f"Ошибка при обновлении канала: {response.text}"}
-                else:
-                    return {"error": f"Аккаунт @{twitter_username} уже отслеживается в этом канале."}
+            account_ids = self._upsert_twitter_accounts(list(dict.fromkeys(twitter_usernames)), user_ids or {})
+            
+            url = f"{self.supabase_url}/rest/v1/subscriptions?on_conflict=account_id,guild_id&select={SUBSCRIPTION_SELECT}"
+            headers = dict(self.headers, Prefer="resolution=merge-duplicates,return=representation")
             
-            # Добавляем новую запись
-            insert_url = f"{self.supabase_url}/rest/v1/tracked_accounts"
-            payload = {
-                "twitter_username": twitter_username,
-                "guild_id": str(guild_id),
-                "channel_id": str(channel_id)
-            }
+            payload = [
+                {
+                    "account_id": account_id,
+                    "guild_id": int(guild_id),
+                    "channel_id": int(channel_id),
+                    "webhook_url": webhook_url
+                }
+                for account_id in dict.fromkeys(account_ids.values())
+            ]
             
-            response = requests.post(insert_url, headers=self.headers, json=payload)
+            response = self.session.post(url, headers=headers, json=payload)
             
-            if response.status_code == 201:
-                return {"message": f"Аккаунт @{twitter_username} добавлен для отслеживания."}
+            if response.status_code in [200, 201]:
+                return {"accounts": [flatten_subscription(row) for row in response.json()]}
             else:
                 return {"error": f"Ошибка при добавлении аккаунта: {response.text}"}
                 
         except Exception as e:
             return {"error": f"Ошибка при добавлении аккаунта: {str(e)}"}
     
-    def remove_tracked_account(self, twitter_username, guild_id):
+    def _upsert_twitter_accounts(self, twitter_usernames, user_ids):
         """
-        Удаляет аккаунт Twitter из списка отслеживаемых
+        Находит или создает записи twitter_accounts
         
         Args:
-            twitter_username (str): Имя пользователя Twitter
+            twitter_usernames (list): Имена пользователей Twitter
+            user_ids (dict): Имя пользователя Twitter -> ID пользователя Twitter
+        
+        Returns:
+            dict: Имя пользователя Twitter -> ID записи twitter_accounts
+        
+        Raises:
+            RuntimeError: Если записи не удалось сохранить
+        """
+        accounts = {}
+        url = f"{self.supabase_url}/rest/v1/twitter_accounts?select=id,handle"
+        
+        # Аккаунты с известным ID пользователя: upsert, после переименования обновится handle.
+        # Перенесенным из tracked_accounts записям user_id заполняет create_tables.py --migrate
+        known = {str(user_ids[username]): username for username in twitter_usernames if user_ids.get(username)}
+        if known:
+            headers = dict(self.headers, Prefer="resolution=merge-duplicates,return=representation")
+            payload = [{"user_id": int(user_id), "handle": username} for user_id, username in known.items()]
+            
+            response = self.session.post(f"{url}&on_conflict=user_id", headers=headers, json=payload)
+            if response.status_code not in [200, 201]:
+                raise RuntimeError(response.text)
+            accounts.update({row["handle"]: row["id"] for row in response.json()})
+        
+        # Остальные ищем по имени без учета регистра и создаем недостающие
+        unknown = [username for username in twitter_usernames if not user_ids.get(username)]
+        if unknown:
+            handles = ",".join(username.lower() for username in unknown)
+            response = self.session.get(f"{url}&handle_lower=in.({handles})&order=id.asc", headers=self.headers)
+            if response.status_code != 200:
+                raise RuntimeError(response.text)
+            found = {}
+            for row in response.json():
+                found.setdefault(row["handle"].lower(), row["id"])
+            accounts.update({username: found[username.lower()] for username in unknown if username.lower() in found})
+            
+            missing = [username for username in unknown if username not in accounts]
+            if missing:
+                response = self.session.post(url, headers=self.headers, json=[{"handle": username} for username in missing])
+                if response.status_code not in [200, 201]:
+                    raise RuntimeError(response.text)
+                accounts.update({row["handle"]: row["id"] for row in response.json()})
+        
+        return accounts
+    
+    def remove_tracked_accounts(self, twitter_usernames, guild_id):
+        """
+        Удаляет подписки сервера на много аккаунтов Twitter.
+        Имена сравниваются без учета регистра.
+        Записи twitter_accounts остаются вместе с since_id.
+        
+        Args:
+            twitter_usernames (list): Имена пользователей Twitter
             guild_id (str): ID сервера Discord
         
         Returns:
-            bool: True если аккаунт успешно удален, False в противном случае
+            list: Сохраненные имена удаленных аккаунтов; аккаунты, которые не отслеживались, пропускаются
         """
         try:
-            delete_url = f"{self.supabase_url}/rest/v1/tracked_accounts?twitter_username=eq.{twitter_username}&guild_id=eq.{guild_id}"
+            usernames = ",".join(dict.fromkeys(username.lower() for username in twitter_usernames))
+            url = f"{self.supabase_url}/rest/v1/twitter_accounts?select=id,handle&handle_lower=in.({usernames})"
             
-            # Сначала проверяем, существует ли запись
-            response = requests.get(delete_url, headers=self.headers)
+            response = self.session.get(url, headers=self.headers)
             
-            if response.status_code != 200 or len(response.json()) == 0:
-                return False
+            if response.status_code != 200:
+                return []
+            
+            handles = {row["id"]: row["handle"] for row in response.json()}
+            if not handles:
+                return []
             
-            # Удаляем запись
-            response = requests.delete(delete_url, headers=self.headers)
+            account_ids = ",".join(str(account_id) for account_id in handles)
+            url = f"{self.supabase_url}/rest/v1/subscriptions?account_id=in.({account_ids})&guild_id=eq.{guild_id}&select=account_id"
             
-            return response.status_code == 204
+            # Удаленные записи возвращаются в ответе (return=representation)
+            response = self.session.delete(url, headers=self.headers)
+            
+            if response.status_code == 200:
+                return list(dict.fromkeys(handles[row["account_id"]] for row in response.json()))
+            return []
             
         except Exception as e:
             print(f"Ошибка при удалении аккаунта: {e}")
-            return False
+            return []
     
-    def get_tracked_accounts(self, guild_id=None):
+    def iter_tracked_accounts(self, guild_id=None, updated_since=None, page_size=DB_PAGE_SIZE):
         """
-        Получает список отслеживаемых аккаунтов Twitter
+        Читает подписки вместе с их аккаунтами Twitter постранично и отдает
+        строки по мере загрузки. Страницы выбираются по id (keyset), поэтому
+        ограничение PostgREST на количество строк в ответе не обрезает список.
         
         Args:
             guild_id (str, optional): ID сервера Discord для фильтрации
+            updated_since (str, optional): Только подписки с updated_at не раньше этого значения
+            page_size (int): Количество строк на странице
+        
+        Yields:
+            dict: Отслеживаемый аккаунт (см. flatten_subscription)
+        
+        Raises:
+            RuntimeError: Если страницу не удалось загрузить
+        """
+        filters = ""
+        if guild_id:
+            filters += f"&guild_id=eq.{guild_id}"
+        if updated_since:
+            filters += f"&updated_at=gte.{quote(updated_since)}"
+        
+        last_id = 0
+        while True:
+            url = (
+                f"{self.supabase_url}/rest/v1/subscriptions?select={SUBSCRIPTION_SELECT}"
+                f"{filters}&id=gt.{last_id}&order=id.asc&limit={page_size}"
+            )
+            response = self.session.get(url, headers=self.headers)
+            
+            if response.status_code != 200:
+                raise RuntimeError(f"Ошибка при чтении отслеживаемых аккаунтов: {response.text}")
+            
+            rows = response.json()
+            # Сервер может отдавать меньше page_size строк, поэтому конец списка - пустая страница
+            if not rows:
+                return
+            
+            yield from (flatten_subscription(row) for row in rows)
+            last_id = rows[-1]["id"]
+    
+    def get_cached_tweet_ids(self, tweet_ids):
+        """
+        Проверяет сразу много твитов: одним запросом на пачку из
+        SUPABASE_LOOKUP_BATCH_SIZE ID вместо запроса на каждый твит
+        
+        Args:
+            tweet_ids (list): ID твитов
         
         Returns:
-            list: Список отслеживаемых аккаунтов
+            set: ID (str) тех твитов, которые уже обработаны
         """
+        tweet_ids = list(dict.fromkeys(str(tweet_id) for tweet_id in tweet_ids))
+        
+        # Большинство ответов дает индекс в памяти, в базу идут только промахи
+        cached = {tweet_id for tweet_id in tweet_ids if tweet_id in self.seen_tweets}
+        missing = [tweet_id for tweet_id in tweet_ids if tweet_id not in cached]
+        
         try:
-            if guild_id:
-                url = f"{self.supabase_url}/rest/v1/tracked_accounts?guild_id=eq.{guild_id}"
-            else:
-                url = f"{self.supabase_url}/rest/v1/tracked_accounts"
+            for start in range(0, len(missing), db_lookup_batch_size):
+                batch = missing[start:start + db_lookup_batch_size]
+                url = f"{self.supabase_url}/rest/v1/cached_tweets?select=tweet_id&tweet_id=in.({','.join(batch)})"
+                
+                response = self.session.get(url, headers=self.headers)
+                
+                if response.status_code == 200:
+                    found = [row["tweet_id"] for row in response.json()]
+                    self.seen_tweets.add(found)
+                    cached.update(found)
             
-            response = requests.get(url, headers=self.headers)
+            return cached
             
-            if response.status_code == 200:
-                return response.json()
-            else:
-                return []
+        except Exception as e:
+            print(f"Ошибка при проверке кэша твитов: {e}")
+            return cached
+    
+    def _insert_cached_tweets(self, tweets):
+        """
+        Записывает много твитов в кэш обработанных твитов одним запросом
+        на пачку из SUPABASE_INSERT_BATCH_SIZE строк. Уже добавленные твиты пропускаются.
+        
+        Args:
+            tweets (list): Пары (ID твита, имя пользователя Twitter)
+        
+        Returns:
+            bool: True если все твиты успешно добавлены в кэш, False в противном случае
+        """
+        try:
+            url = f"{self.supabase_url}/rest/v1/cached_tweets?on_conflict=tweet_id"
+            headers = dict(self.headers, Prefer="resolution=ignore-duplicates,return=minimal")
+            
+            rows = [
+                {"tweet_id": str(tweet_id), "twitter_username": twitter_username}
+                for tweet_id, twitter_username in tweets
+            ]
+            
+            success = True
+            for start in range(0, len(rows), db_insert_batch_size):
+                batch = rows[start:start + db_insert_batch_size]
+                response = self.session.post(url, headers=headers, json=batch)
+                if response.status_code in [200, 201]:
+                    self.seen_tweets.add(row["tweet_id"] for row in batch)
+                else:
+                    success = False
+            
+            return success
+            
+        except Exception as e:
+            print(f"Ошибка при добавлении твитов в кэш: {e}")
+            return False
+    
+    def warm_seen_tweets(self):
+        """
+        Загружает ID последних обработанных твитов из базы в индекс в памяти
+        
+        Returns:
+            int: Количество загруженных ID
+        """
+        tweet_ids = []
+        
+        try:
+            while len(tweet_ids) < self.seen_tweets.capacity:
+                limit = min(DB_PAGE_SIZE, self.seen_tweets.capacity - len(tweet_ids))
+                url = f"{self.supabase_url}/rest/v1/cached_tweets?select=tweet_id&order=id.desc&limit={limit}&offset={len(tweet_ids)}"
+                
+                response = self.session.get(url, headers=self.headers)
+                
+                if response.status_code != 200:
+                    break
+                
+                rows = response.json()
+                tweet_ids.extend(row["tweet_id"] for row in rows)
+                
+                if len(rows) < limit:
+                    break
                 
         except Exception as e:
-            print(f"Ошибка при получении списка отслеживаемых аккаунтов: {e}")
-            return []
+            print(f"Ошибка при загрузке индекса обработанных твитов: {e}")
+        
+        # Строки идут от новых к старым, а в индексе новые должны быть последними
+        self.seen_tweets.add(reversed(tweet_ids))
+        return len(tweet_ids)
+    
+    def prune_cached_tweets(self, retention_days=cached_tweets_retention_days, keep_per_account=cached_tweets_per_account):
+        """
+        Удаляет из кэша обработанных твитов записи старше retention_days дней
+        и все, кроме keep_per_account последних твитов каждого аккаунта в кэше,
+        в том числе уже не отслеживаемого. Удаление идет пачками по
+        CACHED_TWEETS_PRUNE_BATCH_SIZE строк.
+        
+        Args:
+            retention_days (float): Срок хранения в днях, 0 - не ограничен
+            keep_per_account (int): Сколько последних твитов хранить на аккаунт, 0 - без ограничения
+        
+        Returns:
+            int: Количество удаленных записей
+        """
+        deleted = 0
+        
+        try:
+            if retention_days > 0:
+                cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+                deleted += self._delete_cached_tweets(f"created_at=lt.{cutoff.strftime('%Y-%m-%dT%H:%M:%SZ')}&order=id.asc")
+            
+            if keep_per_account > 0:
+                for twitter_username in self._iter_cached_usernames():
+                    deleted += self._delete_cached_tweets(
+                        f"twitter_username=eq.{twitter_username}&order=id.desc&offset={keep_per_account}"
+                    )
+        
+        except Exception as e:
+            print(f"Ошибка при очистке кэша твитов: {e}")
+        
+        return deleted
+    
+    def _iter_cached_usernames(self):
+        """
+        Перебирает имена аккаунтов, твиты которых есть в кэше. В PostgREST нет
+        DISTINCT, поэтому каждое следующее имя берется отдельным запросом по
+        индексу twitter_username: запросов столько же, сколько разных аккаунтов.
+        
+        Yields:
+            str: Имя пользователя Twitter
+        """
+        last = None
+        while True:
+            url = f"{self.supabase_url}/rest/v1/cached_tweets?select=twitter_username&order=twitter_username.asc&limit=1"
+            if last is not None:
+                url += f"&twitter_username=gt.{quote(last)}"
+            response = self.session.get(url, headers=self.headers)
+            
+            if response.status_code != 200:
+                raise RuntimeError(response.text)
+            
+            rows = response.json()
+            if not rows:
+                return
+            last = rows[0]["twitter_username"]
+            yield last
+    
+    def _delete_cached_tweets(self, query):
+        """
+        Удаляет пачками записи кэша твитов, выбранные запросом, пока они не закончатся
+        
+        Args:
+            query (str): Фильтр и сортировка PostgREST для выбора удаляемых записей
+        
+        Returns:
+            int: Количество удаленных записей
+        """
+        deleted = 0
+        headers = dict(self.headers, Prefer="return=minimal")
+        
+        while True:
+            url = f"{self.supabase_url}/rest/v1/cached_tweets?select=id&{query}&limit={cached_tweets_prune_batch_size}"
+            response = self.session.get(url, headers=self.headers)
+            
+            if response.status_code != 200:
+                break
+            
+            ids = [str(row["id"]) for row in response.json()]
+            if not ids:
+                break
+            
+            delete_url = f"{self.supabase_url}/rest/v1/cached_tweets?id=in.({','.join(ids)})"
+            response = self.session.delete(delete_url, headers=headers)
+            
+            if response.status_code not in [200, 204]:
+                break
+            
+            deleted += len(ids)
+            if len(ids) < cached_tweets_prune_batch_size:
+                break
+        
+        return deleted
     
-    def is_tweet_cached(self, tweet_id):
+    def _store_since_ids(self, since_ids):
         """
-        Проверяет, был ли твит уже обработан
+        Записывает ID последних обработанных твитов аккаунтов (since_id): записи
+        twitter_accounts находятся одним запросом (имена без учета регистра)
+        и обновляются одним upsert по id на пачку из SUPABASE_LOOKUP_BATCH_SIZE аккаунтов
         
         Args:
-            tweet_id (str): ID твита
+            since_ids (dict): Имя пользователя Twitter -> ID последнего обработанного твита
         
         Returns:
-            bool: True если твит уже обработан, False в противном случае
+            bool: True если значения успешно сохранены, False в противном случае,
+            в том числе если для какого-то имени не нашлось записи
         """
         try:
-            url = f"{self.supabase_url}/rest/v1/cached_tweets?tweet_id=eq.{tweet_id}"
+            headers = dict(self.headers, Prefer="resolution=merge-duplicates,return=minimal")
+            usernames = {username.lower(): username for username in since_ids}
+            handles = list(usernames)
             
-            response = requests.get(url, headers=self.headers)
+            success = True
+            for start in range(0, len(handles), db_lookup_batch_size):
+                batch = handles[start:start + db_lookup_batch_size]
+                response = self.session.get(
+                    f"{self.supabase_url}/rest/v1/twitter_accounts?select=id,handle&handle_lower=in.({','.join(batch)})",
+                    headers=self.headers
+                )
+                if response.status_code != 200:
+                    success = False
+                    continue
+                
+                # handle входит в строку, потому что upsert проверяет NOT NULL и для существующих записей
+                rows = [row for row in response.json() if row["handle"].lower() in usernames]
+                payload = [
+                    {"id": row["id"], "handle": row["handle"], "since_id": int(since_ids[usernames[row["handle"].lower()]])}
+                    for row in rows
+                ]
+                
+                unmatched = set(batch) - {row["handle"].lower() for row in rows}
+                if unmatched:
+                    print(f"Не найдены аккаунты для сохранения since_id: {', '.join(usernames[handle] for handle in unmatched)}")
+                    success = False
+                if not payload:
+                    continue
+                
+                response = self.session.post(
+                    f"{self.supabase_url}/rest/v1/twitter_accounts?on_conflict=id", headers=headers, json=payload
+                )
+                if response.status_code not in [200, 201, 204]:
+                    success = False
             
-            return response.status_code == 200 and len(response.json()) > 0
+            return success
             
         except Exception as e:
-            print(f"Ошибка при проверке кэша твитов: {e}")
+            print(f"Ошибка при сохранении since_id: {e}")
             return False
     
-    def cache_tweet(self, tweet_id, twitter_username):
+    def _store_last_polled(self, twitter_usernames, polled_at):
         """
-        Добавляет твит в кэш обработанных твитов
+        Записывает время последнего опроса аккаунтов одним запросом
+        на пачку из SUPABASE_LOOKUP_BATCH_SIZE аккаунтов (имена без учета регистра)
         
         Args:
-            tweet_id (str): ID твита
-            twitter_username (str): Имя пользователя Twitter
+            twitter_usernames (list): Имена пользователей Twitter
+            polled_at (float): Время опроса (Unix time)
         
         Returns:
-            bool: True если твит успешно добавлен в кэш, False в противном случае
+            bool: True если значение успешно сохранено, False в противном случае,
+            в том числе если для какого-то имени не нашлось записи
         """
         try:
-            url = f"{self.supabase_url}/rest/v1/cached_tweets"
+            headers = dict(self.headers, Prefer="return=representation")
+            payload = {"last_polled": datetime.fromtimestamp(polled_at, timezone.utc).isoformat()}
+            usernames = {username.lower(): username for username in twitter_usernames}
+            handles = list(usernames)
             
-            payload = {
-                "tweet_id": str(tweet_id),
-                "twitter_username": twitter_username
-            }
+            success = True
+            for start in range(0, len(handles), db_lookup_batch_size):
+                batch = handles[start:start + db_lookup_batch_size]
+                url = f"{self.supabase_url}/rest/v1/twitter_accounts?select=handle&handle_lower=in.({','.join(batch)})"
+                
+                response = self.session.patch(url, headers=headers, json=payload)
+                if response.status_code != 200:
+                    success = False
+                    continue
+                
+                unmatched = set(batch) - {row["handle"].lower() for row in response.json()}
+                if unmatched:
+                    print(f"Не найдены аккаунты для сохранения времени опроса: {', '.join(usernames[handle] for handle in unmatched)}")
+                    success = False
+            
+            return success
+            
+        except Exception as e:
+            print(f"Ошибка при сохранении времени опроса: {e}")
+            return False
+    
+    def add_outbox(self, deliveries):
+        """
+        Записывает в outbox твиты, ожидающие отправки, одним upsert на пачку
+        из SUPABASE_INSERT_BATCH_SIZE строк. Твиты, которые уже ждут отправки
+        в тот же канал, не дублируются; их status и attempts не меняются.
+        
+        Args:
+            deliveries (list): Словари с ключами tweet_id, twitter_username, channel_id и payload (embed.to_dict())
+        
+        Returns:
+            list: Записи (id, tweet_id, channel_id) всех переданных твитов, и новые,
+            и уже ждавшие отправки, или None при ошибке
+        """
+        try:
+            url = f"{self.supabase_url}/rest/v1/outbox?on_conflict=tweet_id,channel_id&select=id,tweet_id,channel_id"
+            headers = dict(self.headers, Prefer="resolution=merge-duplicates,return=representation")
+            
+            rows = [
+                {
+                    "tweet_id": str(delivery["tweet_id"]),
+                    "twitter_username": delivery["twitter_username"],
+                    "channel_id": int(delivery["channel_id"]),
+                    "payload": delivery["payload"]
+                }
+                for delivery in deliveries
+            ]
             
-            response = requests.post(url, headers=self.headers, json=payload)
+            added = []
+            for start in range(0, len(rows), db_insert_batch_size):
+                response = self.session.post(url, headers=headers, json=rows[start:start + db_insert_batch_size])
+                if response.status_code not in [200, 201]:
+                    print(f"Ошибка при записи в outbox: {response.text}")
+                    return None
+                added.extend(
+                    {"id": row["id"], "tweet_id": row["tweet_id"], "channel_id": str(row["channel_id"])}
+                    for row in response.json()
+                )
             
-            return response.status_code == 201
+            return added
+            
+        except Exception as e:
+            print(f"Ошибка при записи в outbox: {e}")
+            return None
+    
+    def get_pending_outbox(self, page_size=DB_PAGE_SIZE):
+        """
+        Получает все неотправленные записи outbox постранично по id,
+        включая записи, отправить которые пока не удалось
+        
+        Args:
+            page_size (int): Количество строк на странице
+        
+        Returns:
+            list: Записи outbox в порядке добавления
+        """
+        rows = []
+        last_id = 0
+        
+        try:
+            while True:
+                url = (
+                    f"{self.supabase_url}/rest/v1/outbox?select=id,tweet_id,twitter_username,channel_id,payload,status,attempts"
+                    f"&id=gt.{last_id}&order=id.asc&limit={page_size}"
+                )
+                response = self.session.get(url, headers=self.headers)
+                
+                if response.status_code != 200:
+                    print(f"Ошибка при чтении outbox: {response.text}")
+                    break
+                
+                page = response.json()
+                if not page:
+                    break
+                
+                for row in page:
+                    row["channel_id"] = str(row["channel_id"])
+                rows.extend(page)
+                last_id = page[-1]["id"]
+                
+        except Exception as e:
+            print(f"Ошибка при чтении outbox: {e}")
+        
+        return rows
+    
+    def _delete_outbox(self, outbox_ids):
+        """
+        Удаляет записи outbox одним запросом на пачку из SUPABASE_LOOKUP_BATCH_SIZE ID
+        
+        Args:
+            outbox_ids (list): ID записей outbox
+        
+        Returns:
+            bool: True если записи удалены, False в противном случае
+        """
+        try:
+            headers = dict(self.headers, Prefer="return=minimal")
+            
+            success = True
+            for start in range(0, len(outbox_ids), db_lookup_batch_size):
+                batch = ",".join(str(outbox_id) for outbox_id in outbox_ids[start:start + db_lookup_batch_size])
+                response = self.session.delete(f"{self.supabase_url}/rest/v1/outbox?id=in.({batch})", headers=headers)
+                if response.status_code not in [200, 204]:
+                    success = False
+            
+            return success
+            
+        except Exception as e:
+            print(f"Ошибка при удалении из outbox: {e}")
+            return False
+    
+    def fail_outbox(self, outbox_ids, attempts):
+        """
+        Отмечает записи outbox, которые не удалось отправить за DELIVERY_MAX_ATTEMPTS
+        попыток; они остаются в outbox и повторяются реже
+        
+        Args:
+            outbox_ids (list): ID записей outbox
+            attempts (int): Количество сделанных попыток
+        
+        Returns:
+            bool: True если записи обновлены, False в противном случае
+        """
+        if not outbox_ids:
+            return True
+        
+        try:
+            headers = dict(self.headers, Prefer="return=minimal")
+            url = f"{self.supabase_url}/rest/v1/outbox?id=in.({','.join(str(outbox_id) for outbox_id in outbox_ids)})"
+            
+            response = self.session.patch(url, headers=headers, json={"status": "failed", "attempts": attempts})
+            
+            return response.status_code in [200, 204]
+            
+        except Exception as e:
+            print(f"Ошибка при обновлении outbox: {e}")
+            return False
+    
+    def prune_outbox(self, retention_days=cached_tweets_retention_days):
+        """
+        Удаляет из outbox записи старше retention_days дней, которые так и не удалось отправить
+        
+        Args:
+            retention_days (float): Срок хранения в днях, 0 - не ограничен
+        
+        Returns:
+            int: Количество удаленных записей
+        """
+        if retention_days <= 0:
+            return 0
+        
+        try:
+            cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+            url = (
+                f"{self.supabase_url}/rest/v1/outbox"
+                f"?created_at=lt.{cutoff.strftime('%Y-%m-%dT%H:%M:%SZ')}&select=id"
+            )
+            
+            response = self.session.delete(url, headers=self.headers)
+            
+            if response.status_code == 200:
+                return len(response.json())
+            return 0
             
         except Exception as e:
-            print(f"Ошибка при добавлении твита в кэш: {e}")
-            return False 
\ No newline at end of file
+            print(f"Ошибка при очистке outbox: {e}")
+            return 0
@@ -0,0 +1,347 @@
+import os
+import asyncio
+from collections import deque
+import aiohttp
+import discord
+from dotenv import load_dotenv
+
+from utils import logger
+
+# Load environment variables
+load_dotenv()
+
+# Number of messages sent to Discord in parallel, each to a different channel
+delivery_workers = int(os.getenv("DELIVERY_WORKERS", "10"))
+
+# How long a channel's first message waits for more to share a message with, in seconds
+delivery_linger = float(os.getenv("DELIVERY_LINGER", "0.5"))
+
+# Attempts per message before it is given up, and the pause before the first retry in seconds (doubled each time)
+delivery_max_attempts = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
+delivery_retry_backoff = float(os.getenv("DELIVERY_RETRY_BACKOFF", "5"))
+DELIVERY_RETRY_MAX_BACKOFF = 300
+
+# Pause between further retries of messages that used up their attempts, in seconds
+delivery_failed_retry_interval = float(os.getenv("DELIVERY_FAILED_RETRY_INTERVAL", "3600"))
+
+# Discord limits per message
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARACTERS = 6000
+
+# Outcomes of a send attempt
+SENT, RETRY, FAILED = "sent", "retry", "failed"
+
+class _Message:
+    __slots__ = ("embed", "description", "webhook_url", "username", "outbox_id", "attempts", "failed")
+    
+    def __init__(self, embed, description, webhook_url, username, outbox_id, attempts=0, failed=False):
+        self.embed = embed
+        self.description = description
+        self.webhook_url = webhook_url
+        self.username = username
+        self.outbox_id = outbox_id
+        self.attempts = attempts
+        self.failed = failed
+    
+    @property
+    def sender(self):
+        # The name only matters for webhook posts; the bot always posts as itself
+        return (self.webhook_url, self.username) if self.webhook_url else None
+
+class DeliveryQueue:
+    """
+    Queue of outgoing messages per Discord channel, drained by a pool of workers.
+    
+    A channel is served by at most one worker at a time, so its messages keep
+    their order, while different channels are sent to in parallel. Workers take
+    turns between channels one message at a time, so a busy account cannot
+    hold up the others.
+    
+    Messages for channels with a webhook are posted through it under the
+    Twitter account's name; webhooks are rate limited separately from the bot
+    token. If the webhook fails, the message is sent by the bot instead.
+    
+    Messages of a channel that are queued close together, e.g. a thread
+    posted between two polls, go out as one Discord message with up to 10
+    embeds. A new message waits DELIVERY_LINGER seconds for company first.
+    
+    Pacing is left to discord.py: its HTTP client tracks the per-route buckets
+    from the X-RateLimit-* response headers, waits when a bucket is empty and
+    retries 429 responses.
+    
+    Messages that could not be sent are retried with a growing pause, up to
+    DELIVERY_MAX_ATTEMPTS attempts, and then every DELIVERY_FAILED_RETRY_INTERVAL
+    seconds, e.g. through a long guild outage. They stay at the front of their
+    channel's queue and the channel waits for the retry, so tweets keep their order. Messages recorded in the outbox
+    are removed from it once sent and marked failed once their attempts are
+    used up; a restart replays everything still in the outbox.
+    """
+    
+    def __init__(self, bot, outbox=None, workers=delivery_workers, linger=delivery_linger):
+        """
+        Args:
+            bot (discord.Client): Client used to look up channels
+            outbox (AsyncProxy, optional): Wrapped Storage that keeps the outbox
+            workers (int): Number of messages sent in parallel
+            linger (float): Seconds a channel's first message waits to be batched
+        """
+        self.bot = bot
+        self.outbox = outbox
+        self.workers = workers
+        self.linger = linger
+        self.messages = 0
+        self.sent = 0
+        self.sent_by_webhook = 0
+        self.failed = 0
+        self.retrying = 0
+        # Outbox IDs of the messages held here, queued or waiting for a retry
+        self._outbox_ids = set()
+        # Channel ID -> pending messages; a channel is listed here exactly
+        # while it waits in the ready queue, is being served or waits for a retry
+        self._queues = {}
+        # Channel ID -> number of messages at the front of its queue that wait for a retry
+        self._retry_pending = {}
+        self._ready = None
+        self._tasks = []
+        # Webhook posts share one pooled HTTP session
+        self._session = None
+        self._webhooks = {}
+        self._dead_webhooks = set()
+    
+    def start(self):
+        """Start the workers in the running event loop"""
+        if self._tasks:
+            return
+        
+        loop = asyncio.get_running_loop()
+        self._session = aiohttp.ClientSession()
+        self._ready = asyncio.Queue()
+        for channel_id in self._queues:
+            if channel_id not in self._retry_pending:
+                self._ready.put_nowait(channel_id)
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+    
+    async def stop(self):
+        """Cancel the workers and close the webhook session; pending messages stay queued until the next start"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._ready = None
+        if self._session is not None:
+            session, self._session = self._session, None
+            self._webhooks.clear()
+            await session.close()
+    
+    def enqueue(self, channel_id, embed, description, webhook_url=None, username=None, outbox_id=None,
+                attempts=0, failed=False):
+        """
+        Queue a message for a channel
+        
+        Args:
+            channel_id (str): Discord channel ID
+            embed (discord.Embed): Message to send
+            description (str): What is sent, for logging, e.g. "tweet 123 from user"
+            webhook_url (str, optional): Channel webhook to post through
+            username (str, optional): Name shown on webhook posts
+            outbox_id (int, optional): ID of the outbox record of this message
+            attempts (int): Send attempts made so far, e.g. by a previous run
+            failed (bool): The message was already marked failed and is only
+                retried every DELIVERY_FAILED_RETRY_INTERVAL seconds
+        """
+        if outbox_id is not None:
+            self._outbox_ids.add(outbox_id)
+        message = _Message(embed, description, webhook_url, username, outbox_id, attempts, failed)
+        self._push(str(channel_id), message)
+    
+    def holds(self, outbox_id):
+        """
+        Returns:
+            bool: True if the message of an outbox record is already queued or waiting for a retry
+        """
+        return outbox_id in self._outbox_ids
+    
+    def _push(self, channel_id, message):
+        queue = self._queues.get(channel_id)
+        if queue is None:
+            queue = self._queues[channel_id] = deque()
+            if self._ready is not None:
+                if self.linger > 0:
+                    asyncio.get_running_loop().call_later(self.linger, self._ready.put_nowait, channel_id)
+                else:
+                    self._ready.put_nowait(channel_id)
+        queue.append(message)
+    
+    def stats(self):
+        """
+        Get the queue depth
+        
+        Returns:
+            dict: Pending embeds, channels with pending embeds, the deepest
+            channel queue, embeds waiting for a retry (also counted as
+            pending), the number of embeds
+            sent (of them through webhooks) so far, the number that used up
+            their attempts and the number of Discord messages sent
+        """
+        depths = [len(queue) for queue in self._queues.values()]
+        return {
+            "pending": sum(depths),
+            "channels": len(depths),
+            "max_depth": max(depths, default=0),
+            "retrying": self.retrying,
+            "messages": self.messages,
+            "sent": self.sent,
+            "sent_by_webhook": self.sent_by_webhook,
+            "failed": self.failed
+        }
+    
+    async def _work(self):
+        while True:
+            channel_id = await self._ready.get()
+            queue = self._queues[channel_id]
+            batch = self._take_batch(queue)
+            try:
+                outcome = await self._send(channel_id, batch)
+            except asyncio.CancelledError:
+                # Sent after the next start()
+                queue.extendleft(reversed(batch))
+                raise
+            await self._settle(channel_id, batch, outcome)
+            
+            # The channel is served again once its retry is due
+            if channel_id in self._retry_pending:
+                continue
+            # Back of the line, so that other channels get their turn
+            if queue:
+                self._ready.put_nowait(channel_id)
+            else:
+                del self._queues[channel_id]
+    
+    def _take_batch(self, queue):
+        """
+        Pop the next messages of a channel that fit in one Discord message:
+        up to 10 embeds within the character limit, all posted under the same name
+        """
+        batch = [queue.popleft()]
+        sender = batch[0].sender
+        characters = len(batch[0].embed)
+        while queue and len(batch) < MAX_EMBEDS_PER_MESSAGE:
+            message = queue[0]
+            if message.sender != sender or characters + len(message.embed) > MAX_EMBED_CHARACTERS:
+                break
+            characters += len(message.embed)
+            batch.append(queue.popleft())
+        return batch
+    
+    async def _settle(self, channel_id, batch, outcome):
+        """
+        Record the outcome of a send: update the outbox and schedule a retry if it failed
+        """
+        outbox_ids = [message.outbox_id for message in batch if message.outbox_id is not None]
+        attempts = max(message.attempts for message in batch)
+        # Messages batched together share retries; the freshest one decides the pace,
+        # unless one of them has already failed
+        fewest_attempts = min(message.attempts for message in batch)
+        any_failed = any(message.failed for message in batch)
+        
+        if outcome == SENT:
+            self.sent += len(batch)
+            self._outbox_ids.difference_update(outbox_ids)
+        elif outcome == RETRY and fewest_attempts < delivery_max_attempts and not any_failed:
+            delay = min(delivery_retry_backoff * 2 ** (fewest_attempts - 1), DELIVERY_RETRY_MAX_BACKOFF)
+            self._schedule_retry(channel_id, batch, delay)
+            return
+        else:
+            # Attempts used up or the channel refused: keep the message, but retry it much less often
+            newly_failed = [message for message in batch if not message.failed]
+            for message in newly_failed:
+                message.failed = True
+            if newly_failed:
+                self.failed += len(newly_failed)
+                logger.error(f"Could not send {len(newly_failed)} tweets to channel {channel_id} after {attempts} attempts")
+            self._schedule_retry(channel_id, batch, delivery_failed_retry_interval)
+        
+        if self.outbox is None or not outbox_ids:
+            return
+        try:
+            if outcome == SENT:
+                await self.outbox.complete_outbox(outbox_ids)
+            else:
+                await self.outbox.fail_outbox(outbox_ids, attempts)
+        except Exception as e:
+            logger.error(f"Error updating the outbox for channel {channel_id}: {e}")
+    
+    def _schedule_retry(self, channel_id, batch, delay):
+        """
+        Put a batch back at the front of its channel's queue and hold the
+        channel until the retry is due, so that newer tweets do not overtake it
+        """
+        logger.info(f"Retrying {len(batch)} tweets for channel {channel_id} in {delay:.0f}s")
+        self._queues[channel_id].extendleft(reversed(batch))
+        self._retry_pending[channel_id] = len(batch)
+        self.retrying += len(batch)
+        asyncio.get_running_loop().call_later(delay, self._retry, channel_id)
+    
+    def _retry(self, channel_id):
+        self.retrying -= self._retry_pending.pop(channel_id)
+        if self._ready is not None:
+            self._ready.put_nowait(channel_id)
+    
+    async def _send(self, channel_id, batch):
+        """
+        Send a batch as one message, through the webhook if there is one
+        
+        Returns:
+            str: SENT, RETRY for errors that may pass, FAILED when Discord refuses the
+            channel; failed messages are retried too, permissions can be fixed
+        """
+        for message in batch:
+            message.attempts += 1
+        embeds = [message.embed for message in batch]
+        description = ", ".join(message.description for message in batch)
+        webhook_url, username = batch[0].webhook_url, batch[0].username
+        
+        if webhook_url and webhook_url not in self._dead_webhooks:
+            if await self._send_by_webhook(channel_id, embeds, description, webhook_url, username):
+                return SENT
+        
+        # Not cached, e.g. while the guild is unavailable
+        channel = self.bot.get_channel(int(channel_id))
+        if not channel:
+            logger.warning(f"Channel {channel_id} not found")
+            return RETRY
+        
+        try:
+            await channel.send(embeds=embeds)
+            self.messages += 1
+            logger.info(f"Sent {description} to channel {channel_id}")
+            return SENT
+        except (discord.Forbidden, discord.NotFound) as e:
+            logger.error(f"Discord refused {description} for channel {channel_id}: {e}")
+            return FAILED
+        except discord.HTTPException as e:
+            logger.error(f"HTTP error sending {description} to channel {channel_id}: {e}")
+        except Exception as e:
+            logger.error(f"Error sending {description} to channel {channel_id}: {e}")
+        return RETRY
+    
+    async def _send_by_webhook(self, channel_id, embeds, description, webhook_url, username):
+        try:
+            webhook = self._webhooks.get(webhook_url)
+            if webhook is None:
+                webhook = self._webhooks[webhook_url] = discord.Webhook.from_url(webhook_url, session=self._session)
+            
+            await webhook.send(embeds=embeds, username=username[:80] if username else discord.utils.MISSING)
+            self.messages += 1
+            self.sent_by_webhook += len(embeds)
+            logger.info(f"Sent {description} to channel {channel_id} via webhook")
+            return True
+        except (discord.NotFound, ValueError):
+            # Deleted in Discord or malformed; the bot posts to this channel itself from now on
+            self._dead_webhooks.add(webhook_url)
+            self._webhooks.pop(webhook_url, None)
+            logger.warning(f"Webhook of channel {channel_id} is gone or invalid, sending as the bot")
+        except discord.HTTPException as e:
+            logger.warning(f"HTTP error sending {description} to channel {channel_id} via webhook, sending as the bot: {e}")
+        except Exception as e:
+            logger.warning(f"Error sending {description} to channel {channel_id} via webhook, sending as the bot: {e}")
+        return False
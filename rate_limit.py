@@ -0,0 +1,175 @@
+import os
+import re
+import time
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Longest time a request may be delayed to stay inside the budget before it is deferred
+rate_limit_max_wait = float(os.getenv("TWITTER_RATE_LIMIT_MAX_WAIT", "30"))
+
+# Number of requests that may be sent back to back before pacing kicks in
+rate_limit_burst = int(os.getenv("TWITTER_RATE_LIMIT_BURST", "10"))
+
+# Twitter API v2 rate limit windows are 15 minutes
+RATE_LIMIT_WINDOW = 15 * 60
+
+class RateLimitDeferred(Exception):
+    """
+    Raised when an endpoint has no request budget left within the allowed wait.
+    The request was not sent and should be retried later.
+    """
+    
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"Rate limit budget for {endpoint} exhausted, retry in {retry_after:.0f}s")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+class _Bucket:
+    def __init__(self, limit, remaining, reset_at):
+        self.limit = limit
+        self.tokens = float(min(remaining, rate_limit_burst))
+        self.last_refill = time.time()
+        self.update(limit, remaining, reset_at)
+    
+    def update(self, limit, remaining, reset_at):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_at = reset_at
+        # Spread the remaining budget evenly over the rest of the window
+        self.rate = remaining / max(reset_at - time.time(), 1.0)
+        self.tokens = min(self.tokens, float(min(remaining, rate_limit_burst)))
+    
+    def refill(self, now):
+        if now >= self.reset_at:
+            # The window is over and no newer headers arrived yet
+            self.update(self.limit, self.limit, now + RATE_LIMIT_WINDOW)
+            self.tokens = float(min(self.limit, rate_limit_burst))
+        else:
+            capacity = float(min(self.remaining, rate_limit_burst))
+            self.tokens = min(capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+class RateLimiter:
+    """
+    Per-endpoint token bucket driven by the x-rate-limit-* response headers.
+    
+    Requests are paced so that an endpoint's remaining budget lasts until the
+    window resets. When the budget cannot be kept without waiting longer than
+    max_wait, or past the caller's deadline, acquire() raises RateLimitDeferred
+    instead of sending the request.
+    """
+    
+    def __init__(self, max_wait=rate_limit_max_wait):
+        self.max_wait = max_wait
+        self._buckets = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def endpoint_for(method, url):
+        """
+        Build the endpoint key used for rate limiting from a request URL,
+        e.g. "GET /2/users/:id/tweets"
+        
+        Args:
+            method (str): HTTP method
+            url (str): Request URL
+        
+        Returns:
+            str: Endpoint key
+        """
+        path = re.sub(r"^https?://[^/]+", "", url).split("?")[0]
+        path = re.sub(r"/by/username/[^/]+", "/by/username/:username", path)
+        # Keep the API version ("/2") but replace resource IDs
+        version, _, rest = path.lstrip("/").partition("/")
+        rest = re.sub(r"(^|/)\d+(?=/|$)", r"\1:id", rest)
+        return f"{method.upper()} /{version}/{rest}"
+    
+    def acquire(self, endpoint, deadline=None):
+        """
+        Reserve one request to an endpoint, sleeping if needed to pace requests
+        
+        Args:
+            endpoint (str): Endpoint key
+            deadline (float, optional): Latest time.time() at which the request
+                may still be sent, e.g. so that it finishes within the caller's timeout
+        
+        Raises:
+            RateLimitDeferred: If the request would have to wait longer than
+                max_wait or past the deadline
+        """
+        with self._lock:
+            bucket = self._buckets.get(endpoint)
+            if bucket is None:
+                # Limits are learned from the first response
+                return
+            
+            now = time.time()
+            bucket.refill(now)
+            
+            if bucket.remaining <= 0:
+                wait = bucket.reset_at - now
+            elif bucket.tokens >= 1:
+                wait = 0.0
+            else:
+                wait = (1 - bucket.tokens) / bucket.rate if bucket.rate > 0 else bucket.reset_at - now
+            
+            if wait > self.max_wait or (wait > 0 and deadline is not None and now + wait > deadline):
+                raise RateLimitDeferred(endpoint, wait)
+            
+            # Reserve the request; negative tokens queue up later callers
+            bucket.tokens -= 1
+            bucket.remaining -= 1
+        
+        if wait > 0:
+            time.sleep(wait)
+    
+    def update_from_headers(self, endpoint, headers):
+        """
+        Update an endpoint's budget from x-rate-limit-* response headers
+        
+        Args:
+            endpoint (str): Endpoint key
+            headers (Mapping): Response headers
+        """
+        try:
+            limit = int(headers["x-rate-limit-limit"])
+            remaining = int(headers["x-rate-limit-remaining"])
+            reset_at = float(headers["x-rate-limit-reset"])
+        except (KeyError, TypeError, ValueError):
+            return
+        
+        with self._lock:
+            bucket = self._buckets.get(endpoint)
+            if bucket is None:
+                self._buckets[endpoint] = _Bucket(limit, remaining, reset_at)
+            elif reset_at > bucket.reset_at or remaining < bucket.remaining:
+                # Responses can arrive out of order, never raise the budget within a window
+                if reset_at <= bucket.reset_at:
+                    remaining = min(remaining, bucket.remaining)
+                bucket.update(limit, remaining, reset_at)
+    
+    def response_hook(self, response, *args, **kwargs):
+        """requests response hook that feeds rate limit headers into the limiter"""
+        endpoint = self.endpoint_for(response.request.method, response.request.url)
+        self.update_from_headers(endpoint, response.headers)
+    
+    def stats(self):
+        """
+        Get the current budget of every known endpoint
+        
+        Returns:
+            dict: Endpoint key -> dict with limit, remaining and seconds until reset
+        """
+        now = time.time()
+        with self._lock:
+            return {
+                endpoint: {
+                    "limit": bucket.limit,
+                    "remaining": max(bucket.remaining, 0),
+                    "reset_in": max(bucket.reset_at - now, 0)
+                }
+                for endpoint, bucket in self._buckets.items()
+            }
@@ -0,0 +1,161 @@
+class SubscriptionRegistry:
+    """
+    In-memory copy of the subscriptions table, indexed by Twitter username,
+    guild and channel.
+    
+    The registry is loaded once, updated directly by the bot's own commands and
+    refreshed incrementally from the updated_at column, so the poll loop and
+    commands read memory instead of the database.
+    """
+    
+    def __init__(self):
+        self.loaded = False
+        # Newest updated_at seen, None when the table has no such column yet
+        self.cursor = None
+        self._rows = {}
+        self._by_username = {}
+        self._by_guild = {}
+        self._by_channel = {}
+    
+    def __len__(self):
+        return len(self._rows)
+    
+    def load(self, rows):
+        """
+        Replace the registry with a full snapshot of the table
+        
+        Args:
+            rows (iterable): All subscription rows
+        """
+        self._rows.clear()
+        self._by_username.clear()
+        self._by_guild.clear()
+        self._by_channel.clear()
+        self.cursor = None
+        self.apply_changes(rows)
+        self.loaded = True
+    
+    def apply_changes(self, rows):
+        """
+        Apply rows read by an incremental refresh and advance the cursor past them
+        
+        Args:
+            rows (iterable): Subscription rows changed since the cursor
+        """
+        for row in rows:
+            self.apply([row])
+            updated_at = row.get("updated_at")
+            if updated_at and (self.cursor is None or updated_at > self.cursor):
+                self.cursor = updated_at
+    
+    def apply(self, rows):
+        """
+        Insert or replace rows, e.g. after an upsert made by this process.
+        The cursor is left alone so that older changes made by other
+        processes are still picked up by the next refresh.
+        
+        Args:
+            rows (list): Subscription rows
+        """
+        for row in rows:
+            key = (row["twitter_username"], str(row["guild_id"]))
+            self._unindex(key)
+            self._rows[key] = row
+            self._by_username.setdefault(key[0], set()).add(key)
+            self._by_guild.setdefault(key[1], set()).add(key)
+            self._by_channel.setdefault(str(row["channel_id"]), set()).add(key)
+    
+    def remove(self, usernames, guild_id):
+        """
+        Drop the subscriptions of a guild to the given accounts
+        
+        Args:
+            usernames (iterable): Twitter usernames
+            guild_id (str): Discord guild ID
+        """
+        for username in usernames:
+            self._unindex((username, str(guild_id)))
+    
+    def for_guild(self, guild_id):
+        """
+        Returns:
+            list: Rows of the accounts tracked in a guild
+        """
+        return [self._rows[key] for key in self._by_guild.get(str(guild_id), ())]
+    
+    def for_channel(self, channel_id):
+        """
+        Returns:
+            list: Rows of the accounts delivered to a channel
+        """
+        return [self._rows[key] for key in self._by_channel.get(str(channel_id), ())]
+    
+    def usernames(self):
+        """
+        Returns:
+            list: Tracked Twitter usernames
+        """
+        return list(self._by_username)
+    
+    def user_ids(self):
+        """
+        Returns:
+            dict: Twitter username -> Twitter user ID, for accounts whose ID is known
+        """
+        return {
+            username: self._rows[key]["user_id"]
+            for username, keys in self._by_username.items()
+            for key in keys
+            if self._rows[key].get("user_id")
+        }
+    
+    def channels_for(self, username):
+        """
+        Returns:
+            list: IDs of the channels subscribed to a Twitter account
+        """
+        return sorted({self._rows[key]["channel_id"] for key in self._by_username.get(username, ())})
+    
+    def webhook_url(self, channel_id):
+        """
+        Returns:
+            str: Webhook stored with the newest subscription of a channel, or None
+        """
+        rows = [self._rows[key] for key in self._by_channel.get(str(channel_id), ()) if self._rows[key].get("webhook_url")]
+        if not rows:
+            return None
+        return max(rows, key=lambda row: row.get("updated_at") or "")["webhook_url"]
+    
+    def since_id(self, username):
+        """
+        Returns:
+            str: Newest watermark stored for a Twitter account, or None
+        """
+        since_ids = [self._rows[key].get("since_id") for key in self._by_username.get(username, ())]
+        since_ids = [since_id for since_id in since_ids if since_id]
+        return max(since_ids, key=int) if since_ids else None
+    
+    def guilds_by_username(self):
+        """
+        Returns:
+            dict: Twitter username -> set of guild IDs following it
+        """
+        return {
+            username: {guild_id for _, guild_id in keys}
+            for username, keys in self._by_username.items()
+        }
+    
+    def _unindex(self, key):
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        
+        for index, value in (
+            (self._by_username, key[0]),
+            (self._by_guild, key[1]),
+            (self._by_channel, str(row["channel_id"]))
+        ):
+            keys = index.get(value)
+            keys.discard(key)
+            if not keys:
+                del index[value]
@@ -0,0 +1,197 @@
+import os
+import time
+import heapq
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Bounds and starting point for the per-account poll interval, in seconds
+poll_min_interval = float(os.getenv("POLL_MIN_INTERVAL", "60"))
+poll_max_interval = float(os.getenv("POLL_MAX_INTERVAL", "3600"))
+poll_initial_interval = float(os.getenv("POLL_INITIAL_INTERVAL", "300"))
+
+# Number of new tweets we aim to find per poll: lower means hotter polling
+poll_target_tweets = float(os.getenv("POLL_TARGET_TWEETS", "1"))
+
+# Weight of the latest observation in the posting rate estimate (0..1)
+poll_rate_smoothing = float(os.getenv("POLL_RATE_SMOOTHING", "0.3"))
+
+def parse_guild_intervals(value):
+    """
+    Parse per-guild maximum poll intervals from "guild_id:seconds,guild_id:seconds"
+    
+    Args:
+        value (str): Raw setting
+    
+    Returns:
+        dict: Guild ID -> maximum poll interval in seconds
+    """
+    intervals = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        guild_id, _, seconds = item.partition(":")
+        intervals[guild_id.strip()] = float(seconds)
+    return intervals
+
+# Guilds that need fresher tweets can cap the interval of the accounts they follow
+poll_guild_intervals = parse_guild_intervals(os.getenv("POLL_GUILD_INTERVALS"))
+
+class _AccountState:
+    def __init__(self, max_interval, now):
+        self.max_interval = max_interval
+        self.interval = min(poll_initial_interval, max_interval)
+        # Tweets per second, seeded so that the first interval is the initial one
+        self.rate = poll_target_tweets / self.interval
+        self.streamed = 0
+        self.last_polled = None
+        self.next_poll = now
+
+class PollScheduler:
+    """
+    Priority queue of accounts ordered by their next poll time.
+    
+    Each account's interval is derived from its observed posting rate, so
+    accounts that post often are polled often and dormant accounts rarely,
+    within POLL_MIN_INTERVAL and POLL_MAX_INTERVAL (or a lower per-guild cap).
+    """
+    
+    def __init__(self, min_interval=poll_min_interval, max_interval=poll_max_interval, guild_intervals=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.guild_intervals = poll_guild_intervals if guild_intervals is None else guild_intervals
+        self._accounts = {}
+        self._heap = []
+    
+    def __len__(self):
+        return len(self._accounts)
+    
+    def __contains__(self, username):
+        return username in self._accounts
+    
+    def sync(self, guilds_by_username, now=None):
+        """
+        Bring the scheduled accounts in line with the current subscriptions.
+        New accounts are due immediately, removed ones are dropped.
+        
+        Args:
+            guilds_by_username (dict): Twitter username -> iterable of guild IDs following it
+        """
+        now = time.time() if now is None else now
+        
+        for username in list(self._accounts):
+            if username not in guilds_by_username:
+                del self._accounts[username]
+        
+        for username, guild_ids in guilds_by_username.items():
+            max_interval = self._max_interval_for(guild_ids)
+            state = self._accounts.get(username)
+            if state is None:
+                self._accounts[username] = _AccountState(max_interval, now)
+                self._push(username, now)
+            elif state.max_interval != max_interval:
+                state.max_interval = max_interval
+                if state.last_polled is not None and state.next_poll > state.last_polled + max_interval:
+                    self._schedule(username, state.last_polled + max_interval)
+    
+    def due(self, now=None):
+        """
+        Pop all accounts whose next poll time has come
+        
+        Returns:
+            list: Usernames to poll now, most overdue first
+        """
+        now = time.time() if now is None else now
+        usernames = []
+        while self._heap and self._heap[0][0] <= now:
+            next_poll, username = heapq.heappop(self._heap)
+            state = self._accounts.get(username)
+            # Skip entries of removed or rescheduled accounts
+            if state is None or state.next_poll != next_poll:
+                continue
+            usernames.append(username)
+        return usernames
+    
+    def record_poll(self, username, new_tweets, now=None):
+        """
+        Update an account's posting rate after a successful poll and schedule the next one
+        
+        Args:
+            username (str): Twitter username
+            new_tweets (int): Number of new tweets the poll returned
+        """
+        now = time.time() if now is None else now
+        state = self._accounts.get(username)
+        if state is None:
+            return
+        
+        # Tweets the stream delivered since the last poll are no longer returned by it
+        new_tweets += state.streamed
+        state.streamed = 0
+        if state.last_polled is not None:
+            observed = new_tweets / max(now - state.last_polled, 1.0)
+            state.rate = poll_rate_smoothing * observed + (1 - poll_rate_smoothing) * state.rate
+        state.last_polled = now
+        
+        interval = poll_target_tweets / state.rate if state.rate > 0 else state.max_interval
+        state.interval = max(self.min_interval, min(interval, state.max_interval))
+        self._schedule(username, now + state.interval)
+    
+    def record_streamed(self, username, new_tweets):
+        """
+        Count tweets of an account delivered by the stream towards its posting
+        rate, which is updated with the next poll
+        
+        Args:
+            username (str): Twitter username
+            new_tweets (int): Number of tweets delivered
+        """
+        state = self._accounts.get(username)
+        if state is not None:
+            state.streamed += new_tweets
+    
+    def postpone(self, username, delay, now=None):
+        """
+        Poll an account again after a delay without changing its posting rate,
+        e.g. after a failed or rate-limited fetch
+        
+        Args:
+            username (str): Twitter username
+            delay (float): Seconds until the next attempt
+        """
+        now = time.time() if now is None else now
+        if username in self._accounts:
+            self._schedule(username, now + max(delay, self.min_interval))
+    
+    def resume(self, now=None):
+        """
+        Bring every account back to its adaptive schedule, e.g. after the
+        filtered stream went down and postponed polls must catch up
+        """
+        now = time.time() if now is None else now
+        for username, state in self._accounts.items():
+            next_poll = (state.last_polled if state.last_polled is not None else now) + state.interval
+            if next_poll < state.next_poll:
+                self._schedule(username, next_poll)
+    
+    def interval(self, username):
+        """
+        Get the current poll interval of an account
+        
+        Returns:
+            float: Interval in seconds, or None if the account is not scheduled
+        """
+        state = self._accounts.get(username)
+        return state.interval if state else None
+    
+    def _max_interval_for(self, guild_ids):
+        caps = [self.guild_intervals[str(guild_id)] for guild_id in guild_ids if str(guild_id) in self.guild_intervals]
+        return max(self.min_interval, min([self.max_interval] + caps))
+    
+    def _schedule(self, username, next_poll):
+        self._accounts[username].next_poll = next_poll
+        self._push(username, next_poll)
+    
+    def _push(self, username, next_poll):
+        heapq.heappush(self._heap, (next_poll, username))
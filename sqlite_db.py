@@ -0,0 +1,618 @@
+import os
+import json
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+from db import (
+    Storage, SeenTweetIndex, DB_PAGE_SIZE, db_lookup_batch_size,
+    cached_tweets_retention_days, cached_tweets_per_account, cached_tweets_prune_batch_size
+)
+
+# Загружаем переменные окружения
+load_dotenv()
+
+# Путь к файлу базы данных SQLite
+sqlite_path = os.getenv("SQLITE_PATH", "tweetsync.db")
+
+# Схема совпадает с таблицами Supabase (supabase_setup.sql)
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS twitter_accounts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER UNIQUE,
+    handle TEXT NOT NULL,
+    since_id INTEGER,
+    last_polled TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS subscriptions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_id INTEGER NOT NULL REFERENCES twitter_accounts(id) ON DELETE CASCADE,
+    guild_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    webhook_url TEXT,
+    options TEXT NOT NULL DEFAULT '{}',
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    UNIQUE(account_id, guild_id)
+);
+
+CREATE TABLE IF NOT EXISTS cached_tweets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tweet_id TEXT NOT NULL UNIQUE,
+    twitter_username TEXT NOT NULL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tweet_id TEXT NOT NULL,
+    twitter_username TEXT NOT NULL,
+    channel_id INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(tweet_id, channel_id)
+);
+
+-- Имена Twitter не зависят от регистра, аккаунты ищутся по lower(handle)
+CREATE INDEX IF NOT EXISTS idx_twitter_accounts_handle_lower ON twitter_accounts(lower(handle));
+DROP INDEX IF EXISTS idx_twitter_accounts_handle;
+CREATE INDEX IF NOT EXISTS idx_subscriptions_guild_id ON subscriptions(guild_id, account_id, channel_id);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_updated_at ON subscriptions(updated_at);
+CREATE INDEX IF NOT EXISTS idx_cached_tweets_twitter_username ON cached_tweets(twitter_username);
+CREATE INDEX IF NOT EXISTS idx_cached_tweets_created_at ON cached_tweets(created_at);
+CREATE INDEX IF NOT EXISTS idx_outbox_status_id ON outbox(status, id);
+
+CREATE TRIGGER IF NOT EXISTS subscriptions_set_updated_at
+AFTER UPDATE ON subscriptions
+FOR EACH ROW WHEN NEW.updated_at IS OLD.updated_at
+BEGIN
+    UPDATE subscriptions SET updated_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now') WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS twitter_accounts_set_updated_at
+AFTER UPDATE ON twitter_accounts
+FOR EACH ROW WHEN NEW.updated_at IS OLD.updated_at
+BEGIN
+    UPDATE twitter_accounts SET updated_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now') WHERE id = NEW.id;
+END;
+"""
+
+# Перенос подписок из старой таблицы tracked_accounts (одна строка на аккаунт и сервер)
+SQLITE_MIGRATE_TRACKED_ACCOUNTS = """
+BEGIN;
+INSERT INTO twitter_accounts (handle, since_id)
+    SELECT twitter_username, MAX(CAST(since_id AS INTEGER)) FROM tracked_accounts
+    WHERE guild_id != 'webhook' AND channel_id != 'webhook'
+    GROUP BY twitter_username;
+INSERT OR IGNORE INTO subscriptions (account_id, guild_id, channel_id)
+    SELECT a.id, CAST(t.guild_id AS INTEGER), CAST(t.channel_id AS INTEGER)
+    FROM tracked_accounts t JOIN twitter_accounts a ON a.handle = t.twitter_username
+    WHERE t.guild_id != 'webhook' AND t.channel_id != 'webhook';
+ALTER TABLE tracked_accounts RENAME TO tracked_accounts_migrated;
+COMMIT;
+"""
+
+# Подписка вместе с ее аккаунтом Twitter, в том же виде, что flatten_subscription
+SQLITE_SUBSCRIPTION_SELECT = """
+SELECT s.id, s.account_id, a.handle AS twitter_username, a.user_id, s.guild_id, s.channel_id,
+       s.webhook_url, a.since_id, s.options, s.updated_at
+FROM subscriptions s JOIN twitter_accounts a ON a.id = s.account_id
+"""
+
+def _subscription_row(row):
+    row = dict(row)
+    for key in ["user_id", "guild_id", "channel_id", "since_id"]:
+        row[key] = str(row[key]) if row[key] is not None else None
+    row["options"] = json.loads(row["options"] or "{}")
+    return row
+
+class SQLiteDatabase(Storage):
+    """
+    Хранилище в локальном файле SQLite в режиме WAL.
+    Подходит для запуска на одном сервере и для работы без сети.
+    """
+    
+    def __init__(self, path=None):
+        self.path = path or sqlite_path
+        
+        # Одно соединение на процесс; методы вызываются из пула потоков, поэтому доступ под блокировкой
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        
+        # ID обработанных твитов в памяти, как и в Database
+        self.seen_tweets = SeenTweetIndex()
+        
+        self._create_tables()
+        
+        super().__init__()
+    
+    def _create_tables(self):
+        """
+        Включает WAL и создает таблицы и индексы, если они не существуют
+        """
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            
+            tables = {row["name"] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            self.connection.executescript(SQLITE_SCHEMA)
+            
+            # Файлы, созданные до разделения на twitter_accounts и subscriptions
+            if "tracked_accounts" in tables:
+                self.connection.executescript(SQLITE_MIGRATE_TRACKED_ACCOUNTS)
+                print("Подписки перенесены из tracked_accounts в twitter_accounts и subscriptions.")
+            
+            # Файлы, созданные до появления вебхуков
+            columns = {row["name"] for row in self.connection.execute("PRAGMA table_info(subscriptions)")}
+            if "webhook_url" not in columns:
+                self.connection.execute("ALTER TABLE subscriptions ADD COLUMN webhook_url TEXT")
+            
+            self.connection.commit()
+    
+    def _execute(self, query, params=()):
+        with self.lock, self.connection:
+            return self.connection.execute(query, params).fetchall()
+    
+    def close(self):
+        """
+        Записывает отложенные изменения и закрывает соединение с базой данных
+        """
+        super().close()
+        with self.lock:
+            self.connection.close()
+    
+    def add_tracked_accounts(self, twitter_usernames, guild_id, channel_id, user_ids=None, webhook_url=None):
+        """
+        Добавляет много аккаунтов Twitter в список отслеживаемых одной транзакцией (upsert).
+        Для уже отслеживаемых на сервере аккаунтов обновляются канал назначения и вебхук.
+        
+        Args:
+            twitter_usernames (list): Имена пользователей Twitter
+            guild_id (str): ID сервера Discord
+            channel_id (str): ID канала Discord
+            user_ids (dict, optional): Имя пользователя Twitter -> ID пользователя Twitter
+            webhook_url (str, optional): URL вебхука канала для отправки твитов
+        
+        Returns:
+            dict: {"accounts": [...]} с сохраненными записями или {"error": ...}
+        """
+        usernames = list(dict.fromkeys(twitter_usernames))
+        user_ids = user_ids or {}
+        
+        try:
+            with self.lock, self.connection:
+                account_ids = [self._upsert_twitter_account(username, user_ids.get(username)) for username in usernames]
+                self.connection.executemany(
+                    "INSERT INTO subscriptions (account_id, guild_id, channel_id, webhook_url) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(account_id, guild_id) DO UPDATE SET "
+                    "channel_id = excluded.channel_id, webhook_url = excluded.webhook_url",
+                    [(account_id, int(guild_id), int(channel_id), webhook_url) for account_id in account_ids]
+                )
+                placeholders = ",".join("?" * len(account_ids))
+                rows = self.connection.execute(
+                    f"{SQLITE_SUBSCRIPTION_SELECT} WHERE s.guild_id = ? AND s.account_id IN ({placeholders})",
+                    [int(guild_id)] + account_ids
+                ).fetchall()
+            return {"accounts": [_subscription_row(row) for row in rows]}
+        
+        except Exception as e:
+            return {"error": f"Ошибка при добавлении аккаунта: {str(e)}"}
+    
+    def _upsert_twitter_account(self, twitter_username, user_id):
+        # Вызывается под блокировкой внутри транзакции
+        if not user_id:
+            row = self.connection.execute(
+                "SELECT id FROM twitter_accounts WHERE lower(handle) = lower(?) ORDER BY id LIMIT 1", (twitter_username,)
+            ).fetchone()
+            if row:
+                return row["id"]
+            return self.connection.execute(
+                "INSERT INTO twitter_accounts (handle) VALUES (?)", (twitter_username,)
+            ).lastrowid
+        
+        # Перенесенные из tracked_accounts аккаунты получают ID пользователя при следующем !track
+        self.connection.execute(
+            "UPDATE twitter_accounts SET user_id = ? WHERE lower(handle) = lower(?) AND user_id IS NULL "
+            "AND NOT EXISTS (SELECT 1 FROM twitter_accounts WHERE user_id = ?)",
+            (int(user_id), twitter_username, int(user_id))
+        )
+        self.connection.execute(
+            "INSERT INTO twitter_accounts (user_id, handle) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET handle = excluded.handle",
+            (int(user_id), twitter_username)
+        )
+        return self.connection.execute(
+            "SELECT id FROM twitter_accounts WHERE user_id = ?", (int(user_id),)
+        ).fetchone()["id"]
+    
+    def remove_tracked_accounts(self, twitter_usernames, guild_id):
+        """
+        Удаляет подписки сервера на много аккаунтов Twitter одной транзакцией.
+        Имена сравниваются без учета регистра.
+        Записи twitter_accounts остаются вместе с since_id.
+        
+        Args:
+            twitter_usernames (list): Имена пользователей Twitter
+            guild_id (str): ID сервера Discord
+        
+        Returns:
+            list: Сохраненные имена удаленных аккаунтов; аккаунты, которые не отслеживались, пропускаются
+        """
+        usernames = list(dict.fromkeys(username.lower() for username in twitter_usernames))
+        placeholders = ",".join("?" * len(usernames))
+        condition = f"guild_id = ? AND account_id IN (SELECT id FROM twitter_accounts WHERE lower(handle) IN ({placeholders}))"
+        
+        try:
+            with self.lock, self.connection:
+                rows = self.connection.execute(
+                    f"{SQLITE_SUBSCRIPTION_SELECT} WHERE s.{condition}",
+                    [int(guild_id)] + usernames
+                ).fetchall()
+                self.connection.execute(f"DELETE FROM subscriptions WHERE {condition}", [int(guild_id)] + usernames)
+            return list(dict.fromkeys(row["twitter_username"] for row in rows))
+        
+        except Exception as e:
+            print(f"Ошибка при удалении аккаунта: {e}")
+            return []
+    
+    def iter_tracked_accounts(self, guild_id=None, updated_since=None, page_size=DB_PAGE_SIZE):
+        """
+        Читает подписки вместе с их аккаунтами Twitter постранично (keyset по id),
+        не удерживая блокировку соединения между страницами
+        
+        Args:
+            guild_id (str, optional): ID сервера Discord для фильтрации
+            updated_since (str, optional): Только подписки с updated_at не раньше этого значения
+            page_size (int): Количество строк на странице
+        
+        Yields:
+            dict: Отслеживаемый аккаунт (см. flatten_subscription)
+        """
+        conditions = ["s.id > ?"]
+        params = []
+        if guild_id:
+            conditions.append("s.guild_id = ?")
+            params.append(int(guild_id))
+        if updated_since:
+            conditions.append("s.updated_at >= ?")
+            params.append(updated_since)
+        
+        query = f"{SQLITE_SUBSCRIPTION_SELECT} WHERE {' AND '.join(conditions)} ORDER BY s.id LIMIT ?"
+        
+        last_id = 0
+        while True:
+            rows = self._execute(query, [last_id] + params + [page_size])
+            yield from (_subscription_row(row) for row in rows)
+            
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1]["id"]
+    
+    def get_cached_tweet_ids(self, tweet_ids):
+        """
+        Проверяет сразу много твитов одним запросом на пачку ID
+        
+        Args:
+            tweet_ids (list): ID твитов
+        
+        Returns:
+            set: ID (str) тех твитов, которые уже обработаны
+        """
+        tweet_ids = list(dict.fromkeys(str(tweet_id) for tweet_id in tweet_ids))
+        
+        cached = {tweet_id for tweet_id in tweet_ids if tweet_id in self.seen_tweets}
+        missing = [tweet_id for tweet_id in tweet_ids if tweet_id not in cached]
+        
+        try:
+            for start in range(0, len(missing), db_lookup_batch_size):
+                batch = missing[start:start + db_lookup_batch_size]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._execute(f"SELECT tweet_id FROM cached_tweets WHERE tweet_id IN ({placeholders})", batch)
+                
+                found = [row["tweet_id"] for row in rows]
+                self.seen_tweets.add(found)
+                cached.update(found)
+            
+            return cached
+        
+        except Exception as e:
+            print(f"Ошибка при проверке кэша твитов: {e}")
+            return cached
+    
+    def _insert_cached_tweets(self, tweets):
+        """
+        Записывает много твитов в кэш обработанных твитов одной транзакцией.
+        Уже добавленные твиты пропускаются.
+        
+        Args:
+            tweets (list): Пары (ID твита, имя пользователя Twitter)
+        
+        Returns:
+            bool: True если все твиты успешно добавлены в кэш, False в противном случае
+        """
+        rows = [(str(tweet_id), twitter_username) for tweet_id, twitter_username in tweets]
+        
+        try:
+            with self.lock, self.connection:
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO cached_tweets (tweet_id, twitter_username) VALUES (?, ?)",
+                    rows
+                )
+            self.seen_tweets.add(tweet_id for tweet_id, _ in rows)
+            return True
+        
+        except Exception as e:
+            print(f"Ошибка при добавлении твитов в кэш: {e}")
+            return False
+    
+    def warm_seen_tweets(self):
+        """
+        Загружает ID последних обработанных твитов из базы в индекс в памяти
+        
+        Returns:
+            int: Количество загруженных ID
+        """
+        try:
+            rows = self._execute(
+                "SELECT tweet_id FROM cached_tweets ORDER BY id DESC LIMIT ?",
+                (self.seen_tweets.capacity,)
+            )
+        except Exception as e:
+            print(f"Ошибка при загрузке индекса обработанных твитов: {e}")
+            return 0
+        
+        # Строки идут от новых к старым, а в индексе новые должны быть последними
+        self.seen_tweets.add(row["tweet_id"] for row in reversed(rows))
+        return len(rows)
+    
+    def prune_cached_tweets(self, retention_days=cached_tweets_retention_days, keep_per_account=cached_tweets_per_account):
+        """
+        Удаляет из кэша обработанных твитов записи старше retention_days дней
+        и все, кроме keep_per_account последних твитов каждого аккаунта.
+        Удаление идет пачками, чтобы не держать блокировку записи долго.
+        
+        Args:
+            retention_days (float): Срок хранения в днях, 0 - не ограничен
+            keep_per_account (int): Сколько последних твитов хранить на аккаунт, 0 - без ограничения
+        
+        Returns:
+            int: Количество удаленных записей
+        """
+        deleted = 0
+        
+        try:
+            if retention_days > 0:
+                deleted += self._delete_cached_tweets(
+                    "SELECT id FROM cached_tweets WHERE created_at < datetime('now', ?) ORDER BY id LIMIT ?",
+                    (f"-{retention_days} days", cached_tweets_prune_batch_size)
+                )
+            
+            if keep_per_account > 0:
+                rows = self._execute("SELECT DISTINCT twitter_username FROM cached_tweets")
+                for row in rows:
+                    deleted += self._delete_cached_tweets(
+                        "SELECT id FROM cached_tweets WHERE twitter_username = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+                        (row["twitter_username"], cached_tweets_prune_batch_size, keep_per_account)
+                    )
+        
+        except Exception as e:
+            print(f"Ошибка при очистке кэша твитов: {e}")
+        
+        return deleted
+    
+    def _delete_cached_tweets(self, select_query, params):
+        deleted = 0
+        while True:
+            with self.lock, self.connection:
+                cursor = self.connection.execute(f"DELETE FROM cached_tweets WHERE id IN ({select_query})", params)
+            deleted += cursor.rowcount
+            if cursor.rowcount < cached_tweets_prune_batch_size:
+                return deleted
+    
+    def _store_since_ids(self, since_ids):
+        """
+        Записывает ID последних обработанных твитов аккаунтов (since_id) одной транзакцией,
+        имена сравниваются без учета регистра
+        
+        Args:
+            since_ids (dict): Имя пользователя Twitter -> ID последнего обработанного твита
+        
+        Returns:
+            bool: True если значения успешно сохранены, False в противном случае,
+            в том числе если для какого-то имени не нашлось записи
+        """
+        try:
+            with self.lock, self.connection:
+                unmatched = [
+                    twitter_username
+                    for twitter_username, since_id in since_ids.items()
+                    if not self.connection.execute(
+                        "UPDATE twitter_accounts SET since_id = ? WHERE lower(handle) = lower(?)",
+                        (int(since_id), twitter_username)
+                    ).rowcount
+                ]
+            if unmatched:
+                print(f"Не найдены аккаунты для сохранения since_id: {', '.join(unmatched)}")
+                return False
+            return True
+        
+        except Exception as e:
+            print(f"Ошибка при сохранении since_id: {e}")
+            return False
+    
+    def _store_last_polled(self, twitter_usernames, polled_at):
+        """
+        Записывает время последнего опроса аккаунтов одной транзакцией,
+        имена сравниваются без учета регистра
+        
+        Args:
+            twitter_usernames (list): Имена пользователей Twitter
+            polled_at (float): Время опроса (Unix time)
+        
+        Returns:
+            bool: True если значение успешно сохранено, False в противном случае,
+            в том числе если для какого-то имени не нашлось записи
+        """
+        try:
+            with self.lock, self.connection:
+                unmatched = [
+                    twitter_username
+                    for twitter_username in twitter_usernames
+                    if not self.connection.execute(
+                        "UPDATE twitter_accounts SET last_polled = strftime('%Y-%m-%dT%H:%M:%fZ', ?, 'unixepoch') "
+                        "WHERE lower(handle) = lower(?)",
+                        (polled_at, twitter_username)
+                    ).rowcount
+                ]
+            if unmatched:
+                print(f"Не найдены аккаунты для сохранения времени опроса: {', '.join(unmatched)}")
+                return False
+            return True
+        
+        except Exception as e:
+            print(f"Ошибка при сохранении времени опроса: {e}")
+            return False
+    
+    def add_outbox(self, deliveries):
+        """
+        Записывает в outbox твиты, ожидающие отправки, одной транзакцией.
+        Твиты, которые уже ждут отправки в тот же канал, не дублируются.
+        
+        Args:
+            deliveries (list): Словари с ключами tweet_id, twitter_username, channel_id и payload (embed.to_dict())
+        
+        Returns:
+            list: Записи (id, tweet_id, channel_id) всех переданных твитов, и новые,
+            и уже ждавшие отправки, или None при ошибке
+        """
+        try:
+            rows = []
+            with self.lock, self.connection:
+                for delivery in deliveries:
+                    key = (str(delivery["tweet_id"]), int(delivery["channel_id"]))
+                    cursor = self.connection.execute(
+                        "INSERT OR IGNORE INTO outbox (tweet_id, twitter_username, channel_id, payload) VALUES (?, ?, ?, ?)",
+                        key[:1] + (delivery["twitter_username"],) + key[1:] + (json.dumps(delivery["payload"]),)
+                    )
+                    if cursor.rowcount:
+                        outbox_id = cursor.lastrowid
+                    else:
+                        outbox_id = self.connection.execute(
+                            "SELECT id FROM outbox WHERE tweet_id = ? AND channel_id = ?", key
+                        ).fetchone()["id"]
+                    rows.append({"id": outbox_id, "tweet_id": key[0], "channel_id": str(key[1])})
+            return rows
+        
+        except Exception as e:
+            print(f"Ошибка при записи в outbox: {e}")
+            return None
+    
+    def get_pending_outbox(self, page_size=DB_PAGE_SIZE):
+        """
+        Получает все неотправленные записи outbox постранично по id,
+        включая записи, отправить которые пока не удалось
+        
+        Args:
+            page_size (int): Количество строк на странице
+        
+        Returns:
+            list: Записи outbox в порядке добавления
+        """
+        rows = []
+        last_id = 0
+        
+        try:
+            while True:
+                page = self._execute(
+                    "SELECT id, tweet_id, twitter_username, channel_id, payload, status, attempts FROM outbox "
+                    "WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, page_size)
+                )
+                if not page:
+                    break
+                
+                for row in page:
+                    row = dict(row)
+                    row["channel_id"] = str(row["channel_id"])
+                    row["payload"] = json.loads(row["payload"])
+                    rows.append(row)
+                last_id = page[-1]["id"]
+        
+        except Exception as e:
+            print(f"Ошибка при чтении outbox: {e}")
+        
+        return rows
+    
+    def _delete_outbox(self, outbox_ids):
+        """
+        Удаляет записи outbox одной транзакцией
+        
+        Args:
+            outbox_ids (list): ID записей outbox
+        
+        Returns:
+            bool: True если записи удалены, False в противном случае
+        """
+        try:
+            with self.lock, self.connection:
+                self.connection.executemany("DELETE FROM outbox WHERE id = ?", [(outbox_id,) for outbox_id in outbox_ids])
+            return True
+        
+        except Exception as e:
+            print(f"Ошибка при удалении из outbox: {e}")
+            return False
+    
+    def fail_outbox(self, outbox_ids, attempts):
+        """
+        Отмечает записи outbox, которые не удалось отправить за DELIVERY_MAX_ATTEMPTS
+        попыток; они остаются в outbox и повторяются реже
+        
+        Args:
+            outbox_ids (list): ID записей outbox
+            attempts (int): Количество сделанных попыток
+        
+        Returns:
+            bool: True если записи обновлены, False в противном случае
+        """
+        try:
+            with self.lock, self.connection:
+                self.connection.executemany(
+                    "UPDATE outbox SET status = 'failed', attempts = ? WHERE id = ?",
+                    [(attempts, outbox_id) for outbox_id in outbox_ids]
+                )
+            return True
+        
+        except Exception as e:
+            print(f"Ошибка при обновлении outbox: {e}")
+            return False
+    
+    def prune_outbox(self, retention_days=cached_tweets_retention_days):
+        """
+        Удаляет из outbox записи старше retention_days дней, которые так и не удалось отправить
+        
+        Args:
+            retention_days (float): Срок хранения в днях, 0 - не ограничен
+        
+        Returns:
+            int: Количество удаленных записей
+        """
+        if retention_days <= 0:
+            return 0
+        
+        try:
+            with self.lock, self.connection:
+                cursor = self.connection.execute(
+                    "DELETE FROM outbox WHERE created_at < datetime('now', ?)",
+                    (f"-{retention_days} days",)
+                )
+            return cursor.rowcount
+        
+        except Exception as e:
+            print(f"Ошибка при очистке outbox: {e}")
+            return 0
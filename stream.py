@@ -0,0 +1,183 @@
+import os
+import time
+import asyncio
+import tweepy
+from dotenv import load_dotenv
+
+from utils import logger
+
+# Load environment variables
+load_dotenv()
+
+bearer_token = os.getenv("TWITTER_BEARER_TOKEN")
+
+# Twitter sends a keep-alive every 20 seconds; a silent connection is restarted after this many seconds
+stream_stall_timeout = float(os.getenv("TWITTER_STREAM_STALL_TIMEOUT", "90"))
+
+# Backoff bounds for restarting a stream that stopped, in seconds
+stream_restart_min_backoff = float(os.getenv("TWITTER_STREAM_MIN_BACKOFF", "5"))
+stream_restart_max_backoff = float(os.getenv("TWITTER_STREAM_MAX_BACKOFF", "320"))
+
+# How often the supervisor checks the connection, in seconds
+STREAM_SUPERVISE_INTERVAL = 10
+
+class TweetStream(tweepy.StreamingClient):
+    """
+    Filtered stream connection running in a daemon thread.
+    Matched tweets are handed to the asyncio loop through a queue.
+    """
+    
+    def __init__(self, loop, queue):
+        super().__init__(bearer_token, daemon=True)
+        self.loop = loop
+        self.queue = queue
+        self.connected = False
+        self.connected_at = None
+        self.last_activity = 0.0
+    
+    def on_connect(self):
+        self.connected = True
+        self.connected_at = self.last_activity = time.time()
+        logger.info("Connected to Twitter filtered stream")
+    
+    def on_keep_alive(self):
+        self.last_activity = time.time()
+    
+    def on_response(self, response):
+        self.last_activity = time.time()
+        if response.data is None:
+            return
+        
+        authors = {str(user.id): user.username for user in response.includes.get("users", [])}
+        username = authors.get(str(response.data.author_id))
+        if username:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, (username, response.data))
+    
+    def on_errors(self, errors):
+        logger.warning(f"Twitter filtered stream errors: {errors}")
+    
+    def on_connection_error(self):
+        self.connected = False
+        logger.warning("Twitter filtered stream connection error, reconnecting")
+    
+    def on_request_error(self, status_code):
+        self.connected = False
+        logger.error(f"Twitter filtered stream request error: HTTP {status_code}")
+    
+    def on_exception(self, exception):
+        logger.error(f"Twitter filtered stream exception: {exception}")
+    
+    def on_disconnect(self):
+        self.connected = False
+        logger.warning("Disconnected from Twitter filtered stream")
+
+class StreamIngestion:
+    """
+    Keeps a filtered stream connected for the tracked accounts and passes
+    matched tweets to the delivery coroutine used by the poller.
+    
+    tweepy already retries dropped connections with backoff; the supervisor
+    restarts the stream when it gives up or stops receiving keep-alives.
+    """
+    
+    def __init__(self, twitter, deliver):
+        """
+        Args:
+            twitter (AsyncProxy): Wrapped TwitterClient used to manage rules
+            deliver (coroutine function): Called as deliver(username, tweets)
+        """
+        self.twitter = twitter
+        self.deliver = deliver
+        self.usernames = set()
+        self._stream = None
+        self._queue = None
+        self._tasks = []
+    
+    @property
+    def healthy(self):
+        """True while the stream is connected and receiving data or keep-alives"""
+        return (
+            self._stream is not None
+            and self._stream.connected
+            and time.time() - self._stream.last_activity < stream_stall_timeout
+        )
+    
+    @property
+    def connected_since(self):
+        """Time the current connection was established, or None while the stream is not healthy"""
+        return self._stream.connected_at if self.healthy else None
+    
+    def start(self):
+        """Start the supervisor and consumer tasks in the running event loop"""
+        if self._tasks:
+            return
+        
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._tasks = [
+            loop.create_task(self._supervise()),
+            loop.create_task(self._consume())
+        ]
+    
+    def stop(self):
+        """Cancel the tasks and close the stream connection"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._stream is not None:
+            self._stream.disconnect()
+    
+    async def update_rules(self, usernames):
+        """
+        Make the stream rules match the tracked accounts
+        
+        Args:
+            usernames (iterable): Tracked Twitter usernames
+        """
+        usernames = set(usernames)
+        if usernames == self.usernames:
+            return
+        
+        # Retried on the next update if the rules could not be changed
+        if await self.twitter.create_filtered_stream_rules(sorted(usernames)) is not None:
+            self.usernames = usernames
+    
+    async def _supervise(self):
+        backoff = 0
+        while True:
+            try:
+                if not self.usernames:
+                    pass
+                elif self._stream is None or not self._stream.thread.is_alive():
+                    if backoff:
+                        logger.info(f"Restarting Twitter filtered stream in {backoff:.0f}s")
+                        await asyncio.sleep(backoff)
+                    self._connect()
+                    backoff = min(max(backoff * 2, stream_restart_min_backoff), stream_restart_max_backoff)
+                elif self.healthy:
+                    backoff = 0
+                elif self._stream.connected:
+                    # No keep-alives: the connection is stuck, drop it and let the next round reconnect
+                    logger.warning("Twitter filtered stream stalled, reconnecting")
+                    self._stream.disconnect()
+            except Exception as e:
+                logger.error(f"Error supervising Twitter filtered stream: {e}")
+            
+            await asyncio.sleep(STREAM_SUPERVISE_INTERVAL)
+    
+    def _connect(self):
+        self._stream = TweetStream(asyncio.get_running_loop(), self._queue)
+        self._stream.filter(
+            expansions=['author_id'],
+            tweet_fields=['created_at', 'text', 'public_metrics', 'author_id'],
+            user_fields=['username'],
+            threaded=True
+        )
+    
+    async def _consume(self):
+        while True:
+            username, tweet = await self._queue.get()
+            try:
+                await self.deliver(username, [tweet])
+            except Exception as e:
+                logger.error(f"Error delivering streamed tweet {tweet.id} from {username}: {e}")
@@ -1,13 +1,66 @@
--- Create tracked_accounts table
-CREATE TABLE IF NOT EXISTS tracked_accounts (
-    id SERIAL PRIMARY KEY,
-    twitter_username TEXT NOT NULL,
-    guild_id TEXT NOT NULL,
-    channel_id TEXT NOT NULL,
+-- Create twitter_accounts table: one row per Twitter user with its polling state
+CREATE TABLE IF NOT EXISTS twitter_accounts (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT UNIQUE,
+    handle TEXT NOT NULL,
+    handle_lower TEXT GENERATED ALWAYS AS (lower(handle)) STORED,
+    since_id BIGINT,
+    last_polled TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+-- Twitter handles are case-insensitive, accounts are looked up by the lowercased handle
+ALTER TABLE twitter_accounts ADD COLUMN IF NOT EXISTS handle_lower TEXT GENERATED ALWAYS AS (lower(handle)) STORED;
+
+-- Create subscriptions table: one row per (Twitter account, Discord guild)
+CREATE TABLE IF NOT EXISTS subscriptions (
+    id BIGSERIAL PRIMARY KEY,
+    account_id BIGINT NOT NULL REFERENCES twitter_accounts(id) ON DELETE CASCADE,
+    guild_id BIGINT NOT NULL,
+    channel_id BIGINT NOT NULL,
     webhook_url TEXT,
+    options JSONB NOT NULL DEFAULT '{}',
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-    UNIQUE(twitter_username, guild_id)
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE(account_id, guild_id)
 );
+ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS webhook_url TEXT;
+
+-- Bump updated_at on every change so that bots can refresh their subscriptions incrementally
+CREATE OR REPLACE FUNCTION set_updated_at() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS twitter_accounts_set_updated_at ON twitter_accounts;
+CREATE TRIGGER twitter_accounts_set_updated_at
+    BEFORE UPDATE ON twitter_accounts
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+DROP TRIGGER IF EXISTS subscriptions_set_updated_at ON subscriptions;
+CREATE TRIGGER subscriptions_set_updated_at
+    BEFORE UPDATE ON subscriptions
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+-- Move subscriptions of the old tracked_accounts table (one row per username and guild).
+-- Twitter user IDs are filled in afterwards by "python create_tables.py --migrate".
+-- The old table is kept; drop it once the bot works with the new tables.
+DO $$
+BEGIN
+    IF to_regclass('public.tracked_accounts') IS NOT NULL AND NOT EXISTS (SELECT 1 FROM twitter_accounts) THEN
+        INSERT INTO twitter_accounts (handle, since_id)
+            SELECT twitter_username, MAX(since_id::BIGINT) FROM tracked_accounts
+            WHERE guild_id <> 'webhook' AND channel_id <> 'webhook'
+            GROUP BY twitter_username;
+        INSERT INTO subscriptions (account_id, guild_id, channel_id)
+            SELECT a.id, t.guild_id::BIGINT, t.channel_id::BIGINT
+            FROM tracked_accounts t JOIN twitter_accounts a ON a.handle = t.twitter_username
+            WHERE t.guild_id <> 'webhook' AND t.channel_id <> 'webhook'
+            ON CONFLICT (account_id, guild_id) DO NOTHING;
+    END IF;
+END $$;
 
 -- Create cached_tweets table
 CREATE TABLE IF NOT EXISTS cached_tweets (
@@ -17,30 +70,70 @@ CREATE TABLE IF NOT EXISTS cached_tweets (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Create outbox table: tweets waiting to be sent to a channel, removed once sent
+CREATE TABLE IF NOT EXISTS outbox (
+    id BIGSERIAL PRIMARY KEY,
+    tweet_id TEXT NOT NULL,
+    twitter_username TEXT NOT NULL,
+    channel_id BIGINT NOT NULL,
+    payload JSONB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE(tweet_id, channel_id)
+);
+
 -- Create indexes for better performance
-CREATE INDEX IF NOT EXISTS idx_tracked_accounts_guild_id ON tracked_accounts(guild_id);
-CREATE INDEX IF NOT EXISTS idx_tracked_accounts_twitter_username ON tracked_accounts(twitter_username);
-CREATE INDEX IF NOT EXISTS idx_cached_tweets_tweet_id ON cached_tweets(tweet_id);
-CREATE INDEX IF NOT EXISTS idx_cached_tweets_twitter_username ON cached_tweets(twitter_username);
+CREATE INDEX IF NOT EXISTS idx_twitter_accounts_handle_lower ON twitter_accounts(handle_lower);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_guild_id ON subscriptions(guild_id) INCLUDE (account_id, channel_id);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_account_id ON subscriptions(account_id) INCLUDE (guild_id, channel_id);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_updated_at ON subscriptions(updated_at);
+CREATE INDEX IF NOT EXISTS idx_cached_tweets_twitter_username_id ON cached_tweets(twitter_username, id);
+CREATE INDEX IF NOT EXISTS idx_cached_tweets_created_at ON cached_tweets(created_at);
+CREATE INDEX IF NOT EXISTS idx_outbox_status_id ON outbox(status, id);
+
+-- tweet_id is already indexed by its UNIQUE constraint, and the (twitter_username, id)
+-- index used for per-account retention also serves lookups by username
+DROP INDEX IF EXISTS idx_twitter_accounts_handle;
+DROP INDEX IF EXISTS idx_cached_tweets_tweet_id;
+DROP INDEX IF EXISTS idx_cached_tweets_twitter_username;
 
 -- Create RLS policies for security
-ALTER TABLE tracked_accounts ENABLE ROW LEVEL SECURITY;
+ALTER TABLE twitter_accounts ENABLE ROW LEVEL SECURITY;
+ALTER TABLE subscriptions ENABLE ROW LEVEL SECURITY;
 ALTER TABLE cached_tweets ENABLE ROW LEVEL SECURITY;
+ALTER TABLE outbox ENABLE ROW LEVEL SECURITY;
 
--- Create policy to allow authenticated users to read tracked_accounts
-CREATE POLICY tracked_accounts_select_policy ON tracked_accounts 
+-- Create policy to allow authenticated users to read twitter_accounts
+CREATE POLICY twitter_accounts_select_policy ON twitter_accounts 
     FOR SELECT USING (auth.role() = 'authenticated');
 
--- Create policy to allow authenticated users to insert into tracked_accounts
-CREATE POLICY tracked_accounts_insert_policy ON tracked_accounts 
+-- Create policy to allow authenticated users to insert into twitter_accounts
+CREATE POLICY twitter_accounts_insert_policy ON twitter_accounts 
     FOR INSERT WITH CHECK (auth.role() = 'authenticated');
 
--- Create policy to allow authenticated users to update tracked_accounts
-CREATE POLICY tracked_accounts_update_policy ON tracked_accounts 
+-- Create policy to allow authenticated users to update twitter_accounts
+CREATE POLICY twitter_accounts_update_policy ON twitter_accounts 
     FOR UPDATE USING (auth.role() = 'authenticated');
 
--- Create policy to allow authenticated users to delete from tracked_accounts
-CREATE POLICY tracked_accounts_delete_policy ON tracked_accounts 
+-- Create policy to allow authenticated users to delete from twitter_accounts
+CREATE POLICY twitter_accounts_delete_policy ON twitter_accounts 
+    FOR DELETE USING (auth.role() = 'authenticated');
+
+-- Create policy to allow authenticated users to read subscriptions
+CREATE POLICY subscriptions_select_policy ON subscriptions 
+    FOR SELECT USING (auth.role() = 'authenticated');
+
+-- Create policy to allow authenticated users to insert into subscriptions
+CREATE POLICY subscriptions_insert_policy ON subscriptions 
+    FOR INSERT WITH CHECK (auth.role() = 'authenticated');
+
+-- Create policy to allow authenticated users to update subscriptions
+CREATE POLICY subscriptions_update_policy ON subscriptions 
+    FOR UPDATE USING (auth.role() = 'authenticated');
+
+-- Create policy to allow authenticated users to delete from subscriptions
+CREATE POLICY subscriptions_delete_policy ON subscriptions 
     FOR DELETE USING (auth.role() = 'authenticated');
 
 -- Create policy to allow authenticated users to read cached_tweets
@@ -57,4 +150,20 @@ CREATE POLICY cached_tweets_update_policy ON cached_tweets
 
 -- Create policy to allow authenticated users to delete from cached_tweets
 CREATE POLICY cached_tweets_delete_policy ON cached_tweets 
+    FOR DELETE USING (auth.role() = 'authenticated'); 
+
+-- Create policy to allow authenticated users to read outbox
+CREATE POLICY outbox_select_policy ON outbox 
+    FOR SELECT USING (auth.role() = 'authenticated');
+
+-- Create policy to allow authenticated users to insert into outbox
+CREATE POLICY outbox_insert_policy ON outbox 
+    FOR INSERT WITH CHECK (auth.role() = 'authenticated');
+
+-- Create policy to allow authenticated users to update outbox
+CREATE POLICY outbox_update_policy ON outbox 
+    FOR UPDATE USING (auth.role() = 'authenticated');
+
+-- Create policy to allow authenticated users to delete from outbox
+CREATE POLICY outbox_delete_policy ON outbox 
     FOR DELETE USING (auth.role() = 'authenticated'); 
\ No newline at end of file
@@ -1,7 +1,14 @@
 import os
+import re
+import json
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+import requests
 import tweepy
 from dotenv import load_dotenv
-from db import Database
+from rate_limit import RateLimiter, RateLimitDeferred
 import ssl
 
 # Load environment variables
@@ -12,93 +19,654 @@ bearer_token = os.getenv("TWITTER_BEARER_TOKEN")
 api_key = os.getenv("TWITTER_API_KEY")
 api_secret = os.getenv("TWITTER_API_SECRET")
 
+# Username -> user ID cache settings
+user_cache_file = os.getenv("TWITTER_USER_CACHE_FILE", "user_id_cache.json")
+user_cache_ttl = int(os.getenv("TWITTER_USER_CACHE_TTL", str(7 * 24 * 3600)))
+user_cache_size = int(os.getenv("TWITTER_USER_CACHE_SIZE", "10000"))
+
+# Maximum number of timeline pages fetched per account when catching up from a since_id
+timeline_max_pages = int(os.getenv("TWITTER_TIMELINE_MAX_PAGES", "5"))
+
+# Search queries packing many "from:" operators: length limit of the API plan and page limit per query
+search_query_max_length = int(os.getenv("TWITTER_SEARCH_QUERY_MAX_LENGTH", "512"))
+search_max_pages = int(os.getenv("TWITTER_SEARCH_MAX_PAGES", "10"))
+
+# Filtered stream rules: length limit and maximum number of rules of the API plan
+stream_rule_max_length = int(os.getenv("TWITTER_STREAM_RULE_MAX_LENGTH", "512"))
+stream_max_rules = int(os.getenv("TWITTER_STREAM_MAX_RULES", "25"))
+
+# Timeout of a single Twitter API request in seconds; tweepy sets none, so a
+# hung connection would hold its executor thread forever
+request_timeout = float(os.getenv("TWITTER_REQUEST_TIMEOUT", "10"))
+
+# Tag of the stream rules managed by the bot
+STREAM_RULE_TAG = "tweetsync"
+
+# Usernames accepted by one users lookup request
+MAX_USERS_PER_LOOKUP = 100
+
+# Recent search only covers the last seven days
+SEARCH_RECENT_WINDOW = timedelta(days=7)
+
+# Twitter snowflake IDs carry their creation time in milliseconds since this epoch
+TWITTER_EPOCH_MS = 1288834974657
+
 # Отключаем проверку SSL-сертификатов
 ssl._create_default_https_context = ssl._create_unverified_context
 
+def pack_usernames(usernames, max_length=search_query_max_length):
+    """
+    Split usernames into groups whose "from:a OR from:b ..." query fits in max_length
+    
+    Args:
+        usernames (list): Twitter usernames
+        max_length (int): Maximum query (or stream rule) length
+    
+    Returns:
+        list: List of username lists, one per query
+    """
+    groups = []
+    group = []
+    length = 0
+    for username in usernames:
+        term_length = len(f"from:{username}")
+        separator_length = len(" OR ") if group else 0
+        if group and length + separator_length + term_length > max_length:
+            groups.append(group)
+            group = []
+            length = 0
+            separator_length = 0
+        group.append(username)
+        length += separator_length + term_length
+    
+    if group:
+        groups.append(group)
+    return groups
+
+def users_query(usernames):
+    """
+    Build a search query (or stream rule) matching tweets from any of the usernames
+    
+    Args:
+        usernames (list): Twitter usernames
+    
+    Returns:
+        str: Query such as "from:a OR from:b"
+    """
+    return " OR ".join(f"from:{username}" for username in usernames)
+
+def rule_usernames(value):
+    """
+    Get the usernames of a "from:a OR from:b" query or stream rule
+    
+    Args:
+        value (str): Query or rule value
+    
+    Returns:
+        list: Usernames, or None if the value is not such a query
+    """
+    usernames = re.findall(r"from:(\w+)", value)
+    if not usernames or users_query(usernames) != value:
+        return None
+    return usernames
+
+def tweet_id_time(tweet_id):
+    """
+    Get the creation time encoded in a tweet ID
+    
+    Args:
+        tweet_id (str): Tweet ID
+    
+    Returns:
+        datetime: Creation time (UTC)
+    """
+    timestamp_ms = (int(tweet_id) >> 22) + TWITTER_EPOCH_MS
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc)
+
+class TimeoutSession(requests.Session):
+    """
+    requests session with a default timeout for every request
+    """
+    
+    def __init__(self, timeout, headers=None):
+        super().__init__()
+        self.timeout = timeout
+        if headers:
+            self.headers.update(headers)
+    
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+class UserIdCache:
+    """
+    LRU cache of Twitter username -> user ID mappings with a TTL,
+    persisted to a local JSON file so it survives restarts
+    """
+    
+    def __init__(self, path=user_cache_file, ttl=user_cache_ttl, max_size=user_cache_size):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+    
+    def get(self, username):
+        """
+        Get a cached user ID
+        
+        Args:
+            username (str): Twitter username
+        
+        Returns:
+            str: User ID, or None if not cached or expired
+        """
+        key = username.lower()
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            
+            user_id, cached_at = entry
+            if time.time() - cached_at > self.ttl:
+                del self._entries[key]
+                return None
+            
+            self._entries.move_to_end(key)
+            return user_id
+    
+    def set(self, username, user_id):
+        """
+        Cache a user ID for a username
+        
+        Args:
+            username (str): Twitter username
+            user_id (str): Twitter user ID
+        """
+        self.set_many({username: user_id})
+    
+    def set_many(self, user_ids):
+        """
+        Cache freshly looked up user IDs, replacing cached entries
+        
+        Args:
+            user_ids (dict): Twitter username -> user ID
+        """
+        if not user_ids:
+            return
+        with self._lock:
+            for username, user_id in user_ids.items():
+                key = username.lower()
+                self._entries[key] = (str(user_id), time.time())
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._save()
+    
+    def update(self, user_ids):
+        """
+        Cache user IDs known from elsewhere (e.g. the database) without
+        overwriting entries that are already cached
+        
+        Args:
+            user_ids (dict): Twitter username -> user ID
+        """
+        with self._lock:
+            added = False
+            for username, user_id in user_ids.items():
+                key = username.lower()
+                if key not in self._entries:
+                    self._entries[key] = (str(user_id), time.time())
+                    added = True
+            
+            if not added:
+                return
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._save()
+    
+    def invalidate(self, username):
+        """
+        Drop a cached user ID, e.g. after the account was renamed or deleted
+        
+        Args:
+            username (str): Twitter username
+        """
+        with self._lock:
+            if self._entries.pop(username.lower(), None) is not None:
+                self._save()
+    
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            
+            # Oldest entries first so the LRU order is preserved
+            for username, (user_id, cached_at) in sorted(data.items(), key=lambda item: item[1][1]):
+                self._entries[username] = (user_id, cached_at)
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Error loading user ID cache {self.path}: {e}")
+    
+    def _save(self):
+        if not self.path:
+            return
+        
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error saving user ID cache {self.path}: {e}")
+
 class TwitterClient:
+    # Rate limit endpoint keys, see RateLimiter.endpoint_for
+    USER_BY_USERNAME_ENDPOINT = "GET /2/users/by/username/:username"
+    USERS_BY_USERNAMES_ENDPOINT = "GET /2/users/by"
+    USERS_TWEETS_ENDPOINT = "GET /2/users/:id/tweets"
+    SEARCH_RECENT_ENDPOINT = "GET /2/tweets/search/recent"
+    
     def __init__(self):
         self.client = tweepy.Client(
             bearer_token=bearer_token,
             consumer_key=api_key,
             consumer_secret=api_secret
         )
-        self.db = Database()
+        self.user_ids = UserIdCache()
+        
+        # Filtered stream rules are managed through the streaming client
+        self.stream_client = tweepy.StreamingClient(bearer_token)
+        
+        # Bound every request, so that a fetch abandoned by POLL_TIMEOUT does
+        # not keep its thread and connection busy
+        for client in (self.client, self.stream_client):
+            client.session = TimeoutSession(request_timeout, client.session.headers)
+        
+        # Track the request budget of every endpoint from the response headers
+        self.rate_limiter = RateLimiter()
+        self.client.session.hooks["response"].append(self.rate_limiter.response_hook)
+        self.stream_client.session.hooks["response"].append(self.rate_limiter.response_hook)
+    
+    def _rate_limited(self, endpoint, error):
+        """
+        Convert a 429 response into RateLimitDeferred so callers retry later
+        
+        Args:
+            endpoint (str): Endpoint key
+            error (tweepy.TooManyRequests): The API error
+        
+        Returns:
+            RateLimitDeferred: Exception to raise
+        """
+        try:
+            retry_after = max(float(error.response.headers["x-rate-limit-reset"]) - time.time(), 0)
+        except (KeyError, TypeError, ValueError):
+            retry_after = 15 * 60
+        print(f"Rate limit exceeded for {endpoint}, deferring for {retry_after:.0f}s")
+        return RateLimitDeferred(endpoint, retry_after)
     
-    def get_user_by_username(self, username):
+    def get_user_by_username(self, username, deadline=None):
         """
         Get Twitter user information by username
         
         Args:
             username (str): Twitter username
+            deadline (float, optional): Latest time the request may be sent, see RateLimiter.acquire
         
         Returns:
-            dict: User information
+            dict: User information, or None if the user was not found or the lookup failed
+        
+        Raises:
+            RateLimitDeferred: If the lookup budget is exhausted
         """
         try:
-            user = self.client.get_user(username=username)
-            return user.data
+            return self._lookup_user(username, deadline)
         except tweepy.TweepyException as e:
             print(f"Error getting user {username}: {e}")
             return None
     
-    def get_recent_tweets(self, username, max_results=10):
+    def get_users_by_usernames(self, usernames, deadline=None):
+        """
+        Get several Twitter users by username, with one request per 100 usernames
+        
+        Args:
+            usernames (list): Twitter usernames
+            deadline (float, optional): Latest time a request may be sent, see RateLimiter.acquire
+        
+        Returns:
+            dict: Lowercased username -> user information for the users that
+            were found, or None if a lookup failed
+        
+        Raises:
+            RateLimitDeferred: If the lookup budget is exhausted
+        """
+        users = {}
+        try:
+            for start in range(0, len(usernames), MAX_USERS_PER_LOOKUP):
+                self.rate_limiter.acquire(self.USERS_BY_USERNAMES_ENDPOINT, deadline)
+                response = self.client.get_users(usernames=usernames[start:start + MAX_USERS_PER_LOOKUP])
+                users.update({user.username.lower(): user for user in response.data or []})
+        except tweepy.TooManyRequests as e:
+            raise self._rate_limited(self.USERS_BY_USERNAMES_ENDPOINT, e)
+        except tweepy.TweepyException as e:
+            print(f"Error getting users {', '.join(usernames)}: {e}")
+            return None
+        
+        self.user_ids.set_many({user.username: user.id for user in users.values()})
+        return users
+    
+    def _lookup_user(self, username, deadline=None):
+        """
+        Look up a user by username and cache the ID
+        
+        Returns:
+            dict: User information, or None if the user was not found
+        
+        Raises:
+            RateLimitDeferred: If the lookup budget is exhausted
+            tweepy.TweepyException: If the API request failed
+        """
+        self.rate_limiter.acquire(self.USER_BY_USERNAME_ENDPOINT, deadline)
+        try:
+            user = self.client.get_user(username=username)
+        except tweepy.TooManyRequests as e:
+            raise self._rate_limited(self.USER_BY_USERNAME_ENDPOINT, e)
+        except tweepy.NotFound:
+            user = None
+        
+        if user and user.data:
+            self.user_ids.set(username, user.data.id)
+            return user.data
+        self.user_ids.invalidate(username)
+        return None
+    
+    def get_user_id(self, username, deadline=None):
+        """
+        Get a Twitter user ID by username, using the local cache when possible
+        
+        Args:
+            username (str): Twitter username
+            deadline (float, optional): Latest time the lookup may be sent, see RateLimiter.acquire
+        
+        Returns:
+            str: User ID, or None if the user was not found
+        
+        Raises:
+            RateLimitDeferred: If the lookup budget is exhausted
+            tweepy.TweepyException: If the API request failed
+        """
+        user_id = self.user_ids.get(username)
+        if user_id:
+            return user_id
+        
+        user = self._lookup_user(username, deadline)
+        return str(user.id) if user else None
+    
+    def remember_user_ids(self, user_ids):
+        """
+        Seed the user ID cache with IDs stored alongside the subscriptions,
+        so tracked accounts are not looked up by username again
+        
+        Args:
+            user_ids (dict): Twitter username -> user ID
+        """
+        self.user_ids.update(user_ids)
+    
+    def get_recent_tweets(self, username, max_results=10, since_id=None, deadline=None):
         """
         Get recent tweets from a user
         
         Args:
             username (str): Twitter username
             max_results (int): Maximum number of tweets to retrieve
+            since_id (str, optional): Only return tweets newer than this ID.
+                All new tweets are returned, following pagination up to
+                TWITTER_TIMELINE_MAX_PAGES pages of 100 tweets.
+            deadline (float, optional): Latest time a request may be sent;
+                pacing that would wait longer defers the fetch instead
         
         Returns:
-            list: List of tweets
+            list: List of tweets, newest first
+        
+        Raises:
+            RateLimitDeferred: If the request budget is exhausted. Nothing was
+                lost, the same since_id can be polled again later.
+            tweepy.TweepyException: If an API request failed, so that the
+                failure is not mistaken for a poll without new tweets
         """
         try:
-            # First get the user ID
-            user = self.get_user_by_username(username)
-            if not user:
+            user_id = self.get_user_id(username, deadline)
+            if not user_id:
                 return []
             
-            # Then get their recent tweets
-            tweets = self.client.get_users_tweets(
-                id=user.id,
-                max_results=max_results,
-                tweet_fields=['created_at', 'text', 'public_metrics']
+            tweets = self._get_timeline(username, user_id, max_results, since_id, deadline)
+            
+            # The cached ID is stale (account deleted or handle renamed),
+            # resolve the username again and retry once
+            if tweets is None:
+                self.user_ids.invalidate(username)
+                user_id = self.get_user_id(username, deadline)
+                if not user_id:
+                    return []
+                tweets = self._get_timeline(username, user_id, max_results, since_id, deadline)
+            
+            return tweets or []
+        except tweepy.TooManyRequests as e:
+            raise self._rate_limited(self.USERS_TWEETS_ENDPOINT, e)
+    
+    def _get_timeline(self, username, user_id, max_results, since_id, deadline=None):
+        """
+        Fetch a user's timeline by ID, paginating when since_id is given
+        
+        Returns:
+            list: List of tweets, or None if the user ID no longer matches the username
+        """
+        if not since_id:
+            response = self._get_users_tweets(username, user_id, deadline, max_results=max_results)
+            if response is None:
+                return None
+            return response.data or []
+        
+        tweets = []
+        pagination_token = None
+        for _ in range(timeline_max_pages):
+            response = self._get_users_tweets(
+                username,
+                user_id,
+                deadline,
+                max_results=100,
+                since_id=since_id,
+                pagination_token=pagination_token
             )
+            if response is None:
+                return None
             
-            return tweets.data if tweets.data else []
-        except tweepy.TweepyException as e:
-            print(f"Error getting tweets for {username}: {e}")
-            return []
+            tweets.extend(response.data or [])
+            pagination_token = (response.meta or {}).get("next_token")
+            if not pagination_token:
+                break
+        else:
+            print(f"Timeline of {username} has more than {timeline_max_pages} pages of new tweets, the rest is skipped")
+        
+        return tweets
+    
+    def _get_users_tweets(self, username, user_id, deadline=None, **params):
+        """
+        Request one page of a user's timeline
+        
+        Returns:
+            tweepy.Response: API response, or None if the user ID no longer matches the username
+        """
+        self.rate_limiter.acquire(self.USERS_TWEETS_ENDPOINT, deadline)
+        try:
+            response = self.client.get_users_tweets(
+                id=user_id,
+                tweet_fields=['created_at', 'text', 'public_metrics'],
+                expansions=['author_id'],
+                user_fields=['username'],
+                **params
+            )
+        except tweepy.NotFound:
+            return None
+        
+        if not response.data:
+            for error in response.errors or []:
+                if error.get("type", "").endswith("resource-not-found"):
+                    return None
+            return response
+        
+        # The handle was renamed: the cached ID now belongs to another username
+        for user in (response.includes or {}).get("users", []):
+            if str(user.id) == str(user_id) and user.username.lower() != username.lower():
+                return None
+        
+        return response
+    
+    def search_recent_tweets_from(self, since_ids, deadline=None):
+        """
+        Get new tweets of several users with one packed search query
+        ("from:a OR from:b ..."), paginating until all new tweets are fetched
+        
+        Args:
+            since_ids (dict): Twitter username -> since_id of that account.
+                Usernames must fit in one query, see pack_usernames.
+            deadline (float, optional): Latest time a request may be sent;
+                pacing that would wait longer defers the search instead
+        
+        Returns:
+            dict: Twitter username -> list of new tweets, newest first
+        
+        Raises:
+            RateLimitDeferred: If the search budget is exhausted
+        """
+        usernames = {username.lower(): username for username in since_ids}
+        tweets_by_username = {username: [] for username in since_ids}
+        
+        # One since_id for the whole query; newer watermarks are applied per account below
+        params = {}
+        since_id = min(int(value) for value in since_ids.values())
+        oldest_allowed = datetime.now(timezone.utc) - SEARCH_RECENT_WINDOW + timedelta(minutes=1)
+        if tweet_id_time(since_id) > oldest_allowed:
+            params["since_id"] = str(since_id)
+        else:
+            params["start_time"] = oldest_allowed.strftime("%Y-%m-%dT%H:%M:%SZ")
+        
+        try:
+            pagination_token = None
+            for _ in range(search_max_pages):
+                self.rate_limiter.acquire(self.SEARCH_RECENT_ENDPOINT, deadline)
+                response = self.client.search_recent_tweets(
+                    query=users_query(since_ids),
+                    max_results=100,
+                    tweet_fields=['created_at', 'text', 'public_metrics', 'author_id'],
+                    expansions=['author_id'],
+                    user_fields=['username'],
+                    next_token=pagination_token,
+                    **params
+                )
+                
+                # Route tweets back to the tracked accounts by author
+                authors = {
+                    str(user.id): user.username.lower()
+                    for user in (response.includes or {}).get("users", [])
+                }
+                for tweet in response.data or []:
+                    username = usernames.get(authors.get(str(tweet.author_id), ""))
+                    if username and int(tweet.id) > int(since_ids[username]):
+                        tweets_by_username[username].append(tweet)
+                
+                pagination_token = (response.meta or {}).get("next_token")
+                if not pagination_token:
+                    break
+            else:
+                print(f"Search for {len(since_ids)} accounts has more than {search_max_pages} pages of new tweets, the rest is skipped")
+        except tweepy.TooManyRequests as e:
+            raise self._rate_limited(self.SEARCH_RECENT_ENDPOINT, e)
+        
+        return tweets_by_username
     
     def create_filtered_stream_rules(self, usernames):
         """
-        Create filtered stream rules for tracking Twitter accounts
+        Make the filtered stream rules cover exactly the given Twitter accounts.
+        
+        Usernames are packed into "from:a OR from:b" rules up to
+        TWITTER_STREAM_RULE_MAX_LENGTH. Only rules that changed are replaced,
+        and replacements are added before the old rules are deleted, so the
+        stream keeps matching every account while the rules are updated.
         
         Args:
             usernames (list): List of Twitter usernames to track
         
         Returns:
-            list: List of created rules
+            list: List of created rules, or None if the rules could not be updated
         """
         try:
-            # First, delete all existing rules
-            rules = self.client.get_rules()
-            if rules.data:
-                rule_ids = [rule.id for rule in rules.data]
-                self.client.delete_rules(rule_ids)
-            
-            # Create new rules for each username
-            rules = []
-            for username in usernames:
-                rules.append(f"from:{username}")
-            
-            if rules:
-                response = self.client.add_rules(rules)
-                return response.data
-            return []
+            desired = {username.lower(): username for username in usernames}
+            
+            # Rules created by the bot: tagged ones, or untagged plain "from:" lists from older versions
+            rules = self.stream_client.get_rules()
+            current = []
+            for rule in rules.data or []:
+                handles = rule_usernames(rule.value)
+                if handles is not None and rule.tag in (STREAM_RULE_TAG, None, ""):
+                    current.append((rule, [handle.lower() for handle in handles]))
+            
+            # Keep rules that only contain wanted, not yet covered accounts
+            covered = set()
+            kept = []
+            to_delete = []
+            for rule, handles in current:
+                if all(handle in desired and handle not in covered for handle in handles):
+                    covered.update(handles)
+                    kept.append((rule, handles))
+                else:
+                    to_delete.append(rule)
+            
+            missing = [desired[handle] for handle in sorted(desired) if handle not in covered]
+            
+            # Top up the shortest kept rules first, then pack the rest into new rules
+            to_add = []
+            for rule, handles in sorted(kept, key=lambda item: len(item[0].value)):
+                if not missing:
+                    break
+                group = pack_usernames(handles + missing, stream_rule_max_length)[0]
+                added = len(group) - len(handles)
+                if added > 0:
+                    to_add.append(group)
+                    to_delete.append(rule)
+                    missing = missing[added:]
+            to_add.extend(pack_usernames(missing, stream_rule_max_length))
+            
+            rule_count = len(current) - len(to_delete) + len(to_add)
+            if rule_count > stream_max_rules:
+                print(f"Stream rules need {rule_count} rules, more than the limit of {stream_max_rules}")
+                return None
+            
+            created = []
+            if to_add:
+                response = self.stream_client.add_rules(
+                    [tweepy.StreamRule(users_query(group), tag=STREAM_RULE_TAG) for group in to_add]
+                )
+                created = response.data or []
+                # Old rules are only deleted once all replacements exist, the next sync retries the rest
+                if response.errors or len(created) < len(to_add):
+                    print(f"Created {len(created)} of {len(to_add)} stream rules: {response.errors}")
+                    return None
+            
+            if to_delete:
+                response = self.stream_client.delete_rules([rule.id for rule in to_delete])
+                if response.errors:
+                    print(f"Error deleting stream rules: {response.errors}")
+                    return None
+            
+            return created
         except tweepy.TweepyException as e:
             print(f"Error creating stream rules: {e}")
-            return []
+            return None
     
     def format_tweet_for_discord(self, tweet, username):
         """
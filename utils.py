@@ -18,6 +18,11 @@ logging.basicConfig(
 
 logger = logging.getLogger("tweetsync")
 
+# Parts shared by every tweet embed
+TWITTER_ICON_URL = "https://abs.twimg.com/icons/apple-touch-icon-192x192.png"
+TWEET_EMBED_COLOR = discord.Color.blue()
+TWEET_EMBED_FOOTER = {"text": "Twitter", "icon_url": TWITTER_ICON_URL}
+
 def create_embed(title, description, color=discord.Color.blue(), fields=None, footer=None, thumbnail=None):
     """
     Create a Discord embed
@@ -77,7 +82,7 @@ def create_tweet_embed(tweet, username):
     embed = discord.Embed(
         title=f"New Tweet from @{username}"[:256],  # Ограничиваем длину заголовка
         description=tweet_text,
-        color=discord.Color.blue(),
+        color=TWEET_EMBED_COLOR,
         url=tweet_url
     )
     
@@ -90,10 +95,10 @@ def create_tweet_embed(tweet, username):
         embed.timestamp = tweet.created_at
     
     # Add Twitter logo as thumbnail
-    embed.set_thumbnail(url="https://abs.twimg.com/icons/apple-touch-icon-192x192.png")
+    embed.set_thumbnail(url=TWITTER_ICON_URL)
     
     # Add footer
-    embed.set_footer(text="Twitter", icon_url="https://abs.twimg.com/icons/apple-touch-icon-192x192.png")
+    embed.set_footer(**TWEET_EMBED_FOOTER)
     
     return embed
 